@@ -12,6 +12,8 @@ import pyvisa
 import numpy as np
 import logging
 
+from visa_session import get_idn, release_resource
+
 
 class GPP25045():
     """
@@ -24,6 +26,7 @@ class GPP25045():
         """
         Initialize the PSU class and establish connection.
 
+        :param visa_rm: VisaSessionManager (shared sessions) or pyvisa.ResourceManager.
         :param resource_name: VISA resource name for the PSU.
         :param alias: Alias for logging.
         :param log_level: Level of logging.
@@ -36,11 +39,12 @@ class GPP25045():
         self.MAX_VOLTAGE = 100.0 # Volt
 
         try:
+            self.rm = visa_rm
             self.psu = visa_rm.open_resource(resource_address)
             self.psu.timeout = 3000
             self.logger.info(f"Connection established with the GW INSTEK GPP250-4.5 PSU."
                              f"\n\tResource address: {resource_address}"
-                             f'\n\tID: {self.get_idn()}')
+                             f'\n\tID: {get_idn(visa_rm, resource_address, self.get_idn)}')
             self.toggle_output(False)
         except pyvisa.VisaIOError as e:
             self.logger.error(f'Failed to connect to the PSU.\n\t{e}')
@@ -155,7 +159,8 @@ class GPP25045():
         if self.psu:
             try:
                 self.toggle_output(False)
-                self.psu.close()
+                release_resource(self.rm, self.psu)
+                self.psu = None
                 self.logger.info("Connection to the PSU closed.")
             except pyvisa.VisaIOError as e:
                 self.logger.error(f"Error closing connection: {e}")
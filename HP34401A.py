@@ -15,8 +15,11 @@ CURRENTLY ONLYD DIRECTLY THROUGH QUERY AND WRITE FUNCTIONS
 """
 
 import pyvisa
+import numpy as np
 import logging
-import time
+
+import ieee488
+from visa_session import get_idn, release_resource
 
 class HP34401A:
     """
@@ -26,10 +29,42 @@ class HP34401A:
     and resistance from a DMM using pyvisa communication.
     """
 
+    FUNCTIONS = ["VOLT:DC", "VOLT:AC", "CURR:DC", "CURR:AC", "RES", "FRES", "FREQ", "PER"]
+
+    # Functions integrating over a number of power line cycles
+    NPLC_FUNCTIONS = ["VOLT:DC", "CURR:DC", "RES", "FRES"]
+
+    NPLC_VALUES = [0.02, 0.2, 1, 10, 100]
+
+    # Resolution of each integration time as a fraction of the range
+    NPLC_RESOLUTION = {0.02: 1e-4, 0.2: 1e-5, 1: 3e-6, 10: 1e-6, 100: 3e-7}
+
+    AUTOZERO_STATES = ['ON', 'OFF', 'ONCE']
+
+    LINE_FREQUENCIES = [50, 60]
+
+    # Timing model (approximate, from the 34401A reading rate specifications)
+    AC_READING_TIME = 1.0     # Seconds per AC reading with the default 20 Hz detector bandwidth
+    GATE_TIME = 0.1           # Default frequency/period gate time in seconds
+    TRIGGER_DELAY = 0.0015    # Automatic trigger delay of DC functions in seconds
+    AUTORANGE_TIME = 0.03     # Additional time per reading with autoranging in seconds
+    READING_OVERHEAD = 0.02   # Seconds of command handling per READ?/MEAS? round trip
+    READING_BYTES = 17        # Bytes per ASCII reading, e.g. '+1.23456789E-03' + CR LF
+    MIN_TIMEOUT = 2.0         # Lower bound of the automatic VISA timeout in seconds
+
+    # Burst acquisition into the internal reading memory
+    TRIGGER_SOURCES = ['IMM', 'EXT', 'BUS']
+    MAX_STORED_READINGS = 512
+
+    # Completion timeouts: COMPLETION_MARGIN times the expected time plus COMPLETION_SLACK seconds
+    COMPLETION_MARGIN = 1.5
+    COMPLETION_SLACK = 1.0
+
     def __init__(self, visa_rm, resource_address, alias='DigitalMultimeter', log_level='INFO'):
         """
         Initialize the Digital Multimeter class and establish a connection.
 
+        :param visa_rm: VisaSessionManager (shared sessions) or pyvisa.ResourceManager.
         :param resource_name: VISA resource name for the multimeter.
         :param alias: Alias for logging.
         :param log_level: Logging level (default: INFO).
@@ -37,13 +72,21 @@ class HP34401A:
         self.LOG_FORMAT = f'%(asctime)s [%(levelname)s] {alias}: %(message)s'
         self.logger = logging.getLogger(__name__)
         logging.basicConfig(format=self.LOG_FORMAT, level=log_level)
+        # Tracked configuration, power-on defaults
+        self.function = 'VOLT:DC'
+        self.range = 'AUTO'
+        self.nplc_by_function = {function: 10 for function in self.NPLC_FUNCTIONS}
+        self.autozero = 'ON'
+        self.line_frequency = 60
+        self.burst_count = 1  # Readings per INIT (sample count * trigger count)
 
         try:
+            self.rm = visa_rm
             self.dmm = visa_rm.open_resource(resource_address)
-            self.dmm.timeout = 5000  # Set timeout to 5 seconds
+            self._update_timeout()
             self.logger.info(f"Connection established with the digital multimeter."
                              f"\n\tResource address: {resource_address}"
-                             f'\n\tID: {self.get_idn()}')
+                             f'\n\tID: {get_idn(visa_rm, resource_address, self.get_idn)}')
         except pyvisa.VisaIOError as e:
             self.logger.error(f'Failed to connect to the digital multimeter.\n\t{e}')
             self.dmm = None
@@ -64,54 +107,279 @@ class HP34401A:
         return
 
 
+    def completion_timeout(self, n_readings=1):
+        """
+        Upper bound of the time n readings may take with the present configuration.
+
+        :param n_readings: Number of readings.
+        :return: Time in seconds.
+        """
+        return self.COMPLETION_MARGIN * self.expected_burst_time(n_readings) + self.COMPLETION_SLACK
+
+    def _update_timeout(self):
+        """
+        Adapt the VISA timeout to the time a single reading may take.
+        """
+        if getattr(self, 'dmm', None) is not None:
+            self.dmm.timeout = int(1000 * max(self.completion_timeout(), self.MIN_TIMEOUT))
+
+    def wait_for_completion(self, timeout=None):
+        """
+        Block until all pending operations have finished (*OPC?). Returns as soon as
+        the meter reports completion.
+
+        :param timeout: Upper bound in seconds. Defaults to completion_timeout().
+        :return: True on completion, False on timeout or error.
+        """
+        try:
+            return ieee488.wait_for_opc(self.dmm, timeout or self.completion_timeout())
+        except pyvisa.VisaIOError as e:
+            self.logger.error(f"Error waiting for operation completion: {e}")
+            return False
+
     def measure_current_dc(self):
         """
         Measure DC current.
 
+        The reply is read as soon as the meter sends it; the VISA timeout is bounded by
+        the expected measurement time instead of sleeping a fixed time.
+
         :return: DC current reading.
         """
+        # MEASure? applies the default configuration of the function
+        self.function = 'CURR:DC'
+        self.range = 'AUTO'
+        self.nplc_by_function['CURR:DC'] = 10
+        self._update_timeout()
         try:
-            self.dmm.write("MEAS:CURR:DC?\n")
-            time.sleep(0.25)
-            current = float(self.dmm.read())
+            current = float(self.dmm.query("MEAS:CURR:DC?"))
             self.logger.info(f"DC Current measured: {current} A")
             return current
-        except pyvisa.VisaIOError as e:
+        except (pyvisa.VisaIOError, ValueError) as e:
             self.logger.error(f"Error measuring DC current: {e}")
             return None
     
     def set_range(self, min, max):
         if min < max:
-            try:
-                self.dmm.write("MEAS:CURR:DC?\n")
-                time.sleep(0.25)
-                current = float(self.dmm.read())
-                self.logger.info(f"DC Current measured: {current} A")
-                return current
-            except pyvisa.VisaIOError as e:
-                self.logger.error(f"Error measuring DC current: {e}")
-                return None
+            return self.measure_current_dc()
         else:
             self.logger.error('Error! Max range value cannot be less than min.')
             return None
         
 
-    def set_function(self, function):
+    @property
+    def nplc(self):
+        """
+        Integration time of the active function in power line cycles, None for functions
+        that do not integrate over line cycles.
+        """
+        return self.nplc_by_function.get(self.function)
+
+    def set_nplc(self, nplc, function=None):
+        """
+        Set the integration time in number of power line cycles.
+
+        :param nplc: Integration time, one of NPLC_VALUES.
+        :param function: Measurement function the setting applies to, one of NPLC_FUNCTIONS.
+                         Defaults to the active function.
+        """
+        function = function or self.function
+        if function not in self.NPLC_FUNCTIONS:
+            self.logger.warning(f"Function '{function}' has no NPLC setting. "
+                                f"Valid functions are: {', '.join(self.NPLC_FUNCTIONS)}")
+        elif nplc in self.NPLC_VALUES:
+            try:
+                self.dmm.write(f"{function}:NPLC {nplc}")
+                self.nplc_by_function[function] = nplc
+                self._update_timeout()
+                self.logger.info(f"Integration time of {function} set to {nplc} NPLC")
+            except pyvisa.VisaIOError as e:
+                self.logger.error(f"Error setting integration time: {e}")
+        else:
+            self.logger.warning(f"Invalid integration time {nplc} NPLC. "
+                                f"Valid values are: {self.NPLC_VALUES}")
+
+    def set_autozero(self, state='ON'):
+        """
+        Set the autozero mode. With autozero ON every reading is followed by a zero
+        measurement, doubling the integration time.
+
+        :param state: One of AUTOZERO_STATES.
+        """
+        if state in self.AUTOZERO_STATES:
+            try:
+                self.dmm.write(f"ZERO:AUTO {state}")
+                self.autozero = 'OFF' if state == 'ONCE' else state
+                self._update_timeout()
+                self.logger.info(f"Autozero set to {state}")
+            except pyvisa.VisaIOError as e:
+                self.logger.error(f"Error setting autozero: {e}")
+        else:
+            self.logger.warning(f"Invalid autozero state '{state}'. "
+                                f"Valid states are: {', '.join(self.AUTOZERO_STATES)}")
+
+    def set_line_frequency(self, frequency=60):
         """
-        Set the measurement function of the multimeter.
+        Set the power line frequency used by the timing model. The meter measures it
+        itself; this only affects expected_reading_time() and the timeouts.
 
-        :param function: Measurement function (e.g., "VOLT:DC", "VOLT:AC", "CURR:DC", "RES").
+        :param frequency: Line frequency in Hz, one of LINE_FREQUENCIES.
         """
-        valid_functions = ["VOLT:DC", "VOLT:AC", "CURR:DC", "CURR:AC", "RES"]
-        if function in valid_functions:
+        if frequency in self.LINE_FREQUENCIES:
+            self.line_frequency = frequency
+            self._update_timeout()
+        else:
+            self.logger.warning(f"Invalid line frequency {frequency} Hz. "
+                                f"Valid values are: {self.LINE_FREQUENCIES}")
+
+    def integration_time(self):
+        """
+        Estimate the measurement time of a single reading inside the meter: integration
+        (twice with autozero), trigger delay and autoranging.
+
+        :return: Time in seconds.
+        """
+        if self.function in self.NPLC_FUNCTIONS:
+            integration = self.nplc / self.line_frequency
+            if self.autozero == 'ON':
+                integration *= 2
+            integration += self.TRIGGER_DELAY
+        elif self.function in ('FREQ', 'PER'):
+            integration = self.GATE_TIME
+        else:
+            integration = self.AC_READING_TIME
+        if self.range == 'AUTO':
+            integration += self.AUTORANGE_TIME
+        return integration
+
+    def expected_reading_time(self):
+        """
+        Estimate how long one triggered reading takes with the present configuration,
+        including the command round trip and the transfer of the result.
+
+        :return: Time in seconds.
+        """
+        return self.expected_burst_time(1)
+
+    def expected_burst_time(self, n):
+        """
+        Estimate how long n readings triggered by one command take, including the
+        transfer of all results.
+
+        :param n: Number of readings.
+        :return: Time in seconds.
+        """
+        transfer = ieee488.transfer_time(getattr(self, 'dmm', None), n * self.READING_BYTES)
+        return n * self.integration_time() + self.READING_OVERHEAD + transfer
+
+    def read(self):
+        """
+        Trigger a reading with the present configuration and return it.
+
+        :return: Reading as float or None if an error occurs.
+        """
+        try:
+            return float(self.dmm.query('READ?'))
+        except (pyvisa.VisaIOError, ValueError) as e:
+            self.logger.error(f"Error reading the multimeter: {e}")
+            return None
+
+    def configure_burst(self, sample_count, trigger_count=1, source='IMM'):
+        """
+        Configure a burst of readings stored in the internal reading memory.
+
+        READ? returns all sample_count * trigger_count readings while a burst is
+        configured; call configure_burst(1) to return to single readings.
+
+        :param sample_count: Readings per trigger (SAMP:COUN).
+        :param trigger_count: Triggers per INIT (TRIG:COUN).
+        :param source: Trigger source, one of TRIGGER_SOURCES. With 'BUS' send *TRG
+                       through write() after acquire_burst() started.
+        """
+        count = sample_count * trigger_count
+        if source not in self.TRIGGER_SOURCES:
+            self.logger.warning(f"Invalid trigger source '{source}'. "
+                                f"Valid sources are: {', '.join(self.TRIGGER_SOURCES)}")
+        elif not 1 <= count <= self.MAX_STORED_READINGS:
+            self.logger.warning(f"A burst must hold 1 to {self.MAX_STORED_READINGS} readings, "
+                                f"got {count}.")
+        else:
+            try:
+                self.dmm.write(f"SAMP:COUN {sample_count}")
+                self.dmm.write(f"TRIG:COUN {trigger_count}")
+                self.dmm.write(f"TRIG:SOUR {source}")
+                self.burst_count = count
+                self.logger.info(f"Burst of {sample_count} x {trigger_count} readings configured "
+                                 f"(trigger source {source})")
+            except pyvisa.VisaIOError as e:
+                self.logger.error(f"Error configuring the burst: {e}")
+
+    def acquire_burst(self, timeout=None):
+        """
+        Take the configured burst into the reading memory and fetch it with a single FETC?.
+
+        Completion is detected with *OPC? instead of sleeping; the readings are parsed
+        in one vectorized pass.
+
+        :param timeout: Upper bound of the acquisition time in seconds. Defaults to
+                        completion_timeout() of the burst; set it for external triggers.
+        :return: Numpy float64 array of the readings or None if an error occurs.
+        """
+        timeout = timeout or self.completion_timeout(self.burst_count)
+        try:
+            self.dmm.write("INIT")
+            if not ieee488.wait_for_opc(self.dmm, timeout):
+                self.logger.error("The burst did not complete.")
+                return None
+            with ieee488.timeout_set(self.dmm, timeout):
+                response = self.dmm.query("FETC?")
+            readings = np.fromstring(response, dtype=np.float64, sep=',')
+        except (pyvisa.VisaIOError, ValueError) as e:
+            self.logger.error(f"Error acquiring the burst: {e}")
+            return None
+        if readings.size != self.burst_count:
+            self.logger.warning(f"Fetched {readings.size} of {self.burst_count} readings.")
+        return readings
+
+    def set_function(self, function, range=None, resolution=None):
+        """
+        Configure the measurement function of the multimeter (CONFigure).
+
+        CONFigure resets the range to the given value (autorange if None) and selects the
+        integration time from the resolution (10 NPLC if None).
+
+        :param function: Measurement function, one of FUNCTIONS.
+        :param range: Optional fixed range in the units of the function.
+        :param resolution: Optional resolution in the units of the function. Requires a range.
+        """
+        if function in self.FUNCTIONS:
+            arguments = ','.join(str(value) for value in (range, resolution) if value is not None)
             try:
-                self.dmm.write(f"CONF{function}\n")
-                self.logger.info(f"Measurement function set to CONF:{function}")
+                self.dmm.write(f"CONF:{function} {arguments}".strip())
+                self.function = function
+                self.range = 'AUTO' if range is None else range
+                if function in self.NPLC_FUNCTIONS:
+                    self.nplc_by_function[function] = self._resolution_nplc(range, resolution)
+                self._update_timeout()
+                self.logger.info(f"Measurement function set to CONF:{function} {arguments}")
             except pyvisa.VisaIOError as e:
                 self.logger.error(f"Error setting measurement function: {e}")
         else:
             self.logger.warning(f"Invalid measurement function '{function}'. "
-                                f"Valid functions are: {', '.join(valid_functions)}")
+                                f"Valid functions are: {', '.join(self.FUNCTIONS)}")
+
+    def _resolution_nplc(self, range, resolution):
+        """
+        Integration time the meter selects for a resolution.
+
+        :return: NPLC value, 10 if the resolution is not given.
+        """
+        if range is None or resolution is None:
+            return 10
+        for nplc in self.NPLC_VALUES:
+            if self.NPLC_RESOLUTION[nplc] * range <= resolution:
+                return nplc
+        return self.NPLC_VALUES[-1]
 
     def write(self, command):
         if isinstance(command, str):
@@ -135,7 +403,8 @@ class HP34401A:
         """
         if self.dmm:
             try:
-                self.dmm.close()
+                release_resource(self.rm, self.dmm)
+                self.dmm = None
                 self.logger.info("Connection to the digital multimeter closed.")
             except pyvisa.VisaIOError as e:
                 self.logger.error(f"Error closing connection to the multimeter: {e}")
@@ -11,8 +11,12 @@ Updated: 2024-10-08
 """
 
 import pyvisa
+import numpy as np
 import logging
 
+import ieee488
+from visa_session import get_session_manager, get_idn, release_resource
+
 
 class HP3457A:
     """
@@ -29,9 +33,49 @@ class HP3457A:
                'SREAL', 
                'DREAL'
                ]
+
+    # Big-endian numpy dtypes of the binary data return formats.
+    # SINT/DINT readings are integers to be multiplied by the ISCALE? factor.
+    FORMAT_DTYPES = {'SINT': np.dtype('>i2'),
+                     'DINT': np.dtype('>i4'),
+                     'SREAL': np.dtype('>f4'),
+                     'DREAL': np.dtype('>f8')
+                     }
     
     BEEPER_STATUS = ['ON','OFF','ONCE']
 
+    # Integration times in power line cycles
+    NPLC_VALUES = [0.0005, 0.005, 0.1, 1, 10, 100]
+
+    # Functions integrating over a number of power line cycles
+    NPLC_FUNCTIONS = ['DCV', 'OHM', 'OHMF', 'DCI']
+
+    AUTOZERO_STATES = ['ON', 'OFF', 'ONCE']
+
+    LINE_FREQUENCIES = [50, 60]
+
+    # Timing model (approximate, from the 3457A reading rate specifications)
+    AC_READING_TIME = 1.0     # Seconds per AC reading with the default AC bandwidth
+    GATE_TIME = 0.1           # Default frequency/period gate time in seconds
+    TRIGGER_DELAY = 0.0005    # Default trigger delay of DC functions in seconds
+    AUTORANGE_TIME = 0.03     # Additional time per reading with autoranging in seconds
+    READING_OVERHEAD = 0.01   # Seconds of command handling per triggered reading
+    ASCII_READING_BYTES = 16  # Bytes per reading in the ASCII output format
+    MIN_TIMEOUT = 2.0         # Lower bound of the automatic VISA timeout in seconds
+
+    # Multi-reading acquisition
+    TRIGGER_EVENTS = ['AUTO', 'EXT', 'SGL', 'HOLD', 'SYN']
+    SAMPLE_EVENTS = ['AUTO', 'EXT', 'SYN', 'TIMER', 'LINE', 'LEVEL']
+
+    # Status register bits
+    STATUS_READY = 16        # Ready for instructions
+    STATUS_ERROR = 32
+    STATUS_DATA_READY = 128
+
+    # Completion timeouts: COMPLETION_MARGIN times the expected time plus COMPLETION_SLACK seconds
+    COMPLETION_MARGIN = 1.5
+    COMPLETION_SLACK = 1.0
+
     # List of functions
     FUNCTIONS = ['DCV',
                  'ACV',
@@ -95,26 +139,40 @@ class HP3457A:
                     '.005': {'acc': .08, 'counts': 10}, '.0005': {'acc': .08, 'counts': 5}}
                     }
 
-    def __init__(self, resource_name, alias='DigitalMultimeter', log_level='INFO'):
+    def __init__(self, resource_name, alias='DigitalMultimeter', log_level='INFO', visa_rm=None):
         """
         Initialize the Digital Multimeter class and establish a connection.
 
         :param resource_name: VISA resource name for the multimeter.
         :param alias: Alias for logging.
         :param log_level: Logging level (default: INFO).
+        :param visa_rm: VisaSessionManager or pyvisa.ResourceManager. Defaults to the shared
+                        session manager.
         """
         self.LOG_FORMAT = f'%(asctime)s [%(levelname)s] {alias}: %(message)s'
         self.logger = logging.getLogger(__name__)
         logging.basicConfig(format=self.LOG_FORMAT, level=log_level)
         self.dmm_address = resource_name
+        self.format = 'ASCII'
+        # Tracked configuration, power-on defaults
+        self.function = 'DCV'
+        self.range = 'AUTO'
+        self.nplc = 10
+        self.autozero = 'ON'
+        self.line_frequency = 60
+        self.use_srq = False
+        self.n_readings = 1          # Readings per trigger (NRDGS)
+        self.sample_event = 'AUTO'   # NRDGS sample event
+        self.sample_interval = None  # TIMER interval in seconds
+        self._scale = None  # Cached ISCALE? factor of the integer formats
 
         try:
-            self.rm = pyvisa.ResourceManager()
+            self.rm = visa_rm if visa_rm is not None else get_session_manager()
             self.dmm = self.rm.open_resource(self.dmm_address)
-            self.dmm.timeout = 5000  # Set timeout to 5 seconds
+            self._update_timeout()
             self.logger.info(f"Connection established with the digital multimeter."
                              f"\n\tResource address: {self.dmm_address}"
-                             f'\n\tID: {self.get_idn()}')
+                             f'\n\tID: {get_idn(self.rm, self.dmm_address, self.get_idn)}')
         except pyvisa.VisaIOError as e:
             self.logger.error(f'Failed to connect to the digital multimeter.\n\t{e}')
             self.dmm = None
@@ -142,19 +200,385 @@ class HP3457A:
         if self._check_format(format):
             try:
                 self.dmm.write(f'OFORMAT\\s{format};')
+                self.format = format
+                self._configuration_changed()
                 self.logger.info(f'Format  has been set to {format}')
             except pyvisa.VisaIOError as e:
                 self.logger.error(f'Couldn\'t set reading format to {format}: {e}')
         else:
             self.logger.warning(f'Entered format is not allowed. Allowed formats: {self.FORMATS}')
 
+    def set_nplc(self, nplc):
+        """
+        Set the integration time in number of power line cycles.
+
+        :param nplc: Integration time, one of NPLC_VALUES.
+        """
+        if nplc in self.NPLC_VALUES:
+            try:
+                self.dmm.write(f'NPLC\\s{nplc}')
+                self.nplc = nplc
+                self._configuration_changed()
+                self.logger.info(f'Integration time set to {nplc} NPLC')
+            except pyvisa.VisaIOError as e:
+                self.logger.error(f'Error setting integration time: {e}')
+        else:
+            self.logger.warning(f'Invalid integration time {nplc} NPLC. '
+                                f'Valid values are: {self.NPLC_VALUES}')
+
+    def set_range(self, range='AUTO'):
+        """
+        Set the measurement range of the active function.
+
+        :param range: Maximum expected value in the units of the function, or 'AUTO'.
+        """
+        try:
+            self.dmm.write(f'RANGE\\s{range}')
+            self.range = range
+            self._configuration_changed()
+            self.logger.info(f'Range set to {range}')
+        except pyvisa.VisaIOError as e:
+            self.logger.error(f'Error setting range: {e}')
+
+    def set_autozero(self, state='ON'):
+        """
+        Set the autozero mode. With autozero ON every reading is followed by a zero
+        measurement, doubling the integration time.
+
+        :param state: One of AUTOZERO_STATES.
+        """
+        if state in self.AUTOZERO_STATES:
+            try:
+                self.dmm.write(f'AZERO\\s{state}')
+                self.autozero = 'OFF' if state == 'ONCE' else state
+                self._configuration_changed()
+                self.logger.info(f'Autozero set to {state}')
+            except pyvisa.VisaIOError as e:
+                self.logger.error(f'Error setting autozero: {e}')
+        else:
+            self.logger.warning(f'Invalid autozero state {state}. '
+                                f'Valid states are: {self.AUTOZERO_STATES}')
+
+    def set_line_frequency(self, frequency=60):
+        """
+        Set the power line frequency the integration time refers to.
+
+        :param frequency: Line frequency in Hz, one of LINE_FREQUENCIES.
+        """
+        if frequency in self.LINE_FREQUENCIES:
+            try:
+                self.dmm.write(f'LFREQ\\s{frequency}')
+                self.line_frequency = frequency
+                self._configuration_changed()
+            except pyvisa.VisaIOError as e:
+                self.logger.error(f'Error setting line frequency: {e}')
+        else:
+            self.logger.warning(f'Invalid line frequency {frequency} Hz. '
+                                f'Valid values are: {self.LINE_FREQUENCIES}')
+
+    def integration_time(self):
+        """
+        Estimate the measurement time of a single reading inside the meter: integration
+        (twice with autozero), trigger delay and autoranging.
+
+        :return: Time in seconds.
+        """
+        if self.function in self.NPLC_FUNCTIONS:
+            integration = self.nplc / self.line_frequency
+            if self.autozero == 'ON':
+                integration *= 2
+            integration += self.TRIGGER_DELAY
+        elif self.function in ('FREQ', 'PER'):
+            integration = self.GATE_TIME
+        else:
+            integration = self.AC_READING_TIME
+        if self.range == 'AUTO':
+            integration += self.AUTORANGE_TIME
+        return integration
+
+    def reading_bytes(self):
+        """
+        :return: Number of bytes per reading in the active output format.
+        """
+        if self.format in self.FORMAT_DTYPES:
+            return self.FORMAT_DTYPES[self.format].itemsize
+        return self.ASCII_READING_BYTES
+
+    def expected_reading_time(self):
+        """
+        Estimate how long one triggered reading takes with the present configuration,
+        including the command handling and the transfer of the result.
+
+        :return: Time in seconds.
+        """
+        return self.expected_burst_time(1)
+
+    def expected_burst_time(self, n):
+        """
+        Estimate how long n readings triggered by one command take, including the
+        transfer of all results.
+
+        :param n: Number of readings.
+        :return: Time in seconds.
+        """
+        transfer = ieee488.transfer_time(getattr(self, 'dmm', None), n * self.reading_bytes())
+        period = self.integration_time()
+        if self.sample_event == 'TIMER' and self.sample_interval:
+            period = max(period, self.sample_interval)
+        return n * period + self.READING_OVERHEAD + transfer
+
+    def completion_timeout(self, n_readings=1):
+        """
+        Upper bound of the time n readings may take with the present configuration.
+
+        :param n_readings: Number of readings.
+        :return: Time in seconds.
+        """
+        return self.COMPLETION_MARGIN * self.expected_burst_time(n_readings) + self.COMPLETION_SLACK
+
+    def _configuration_changed(self):
+        """
+        Invalidate the cached integer scale factor and adapt the VISA timeout after a
+        change of function, range, integration time or output format.
+        """
+        self._scale = None
+        self._update_timeout()
+
+    def _update_timeout(self):
+        """
+        Adapt the VISA timeout to the time a single reading may take.
+        """
+        if getattr(self, 'dmm', None) is not None:
+            self.dmm.timeout = int(1000 * max(self.completion_timeout(), self.MIN_TIMEOUT))
+
+    def set_service_request(self, enabled=True):
+        """
+        Make the meter assert SRQ when a reading is available, so wait_for_data() sleeps on
+        the service request instead of serial polling.
+
+        :param enabled: Enable the data ready service request if true, disable it otherwise.
+        """
+        try:
+            self.dmm.write(f'RQS\\s{self.STATUS_DATA_READY if enabled else 0}')
+            self.use_srq = enabled
+            self.logger.info(f'Data ready service request {"enabled" if enabled else "disabled"}')
+        except pyvisa.VisaIOError as e:
+            self.logger.error(f'Error setting the service request mask: {e}')
+
+    def wait_for_data(self, timeout=None):
+        """
+        Wait until a reading is available in the output buffer (status register bit 7).
+
+        :param timeout: Upper bound in seconds. Defaults to completion_timeout().
+        :return: True if data is ready, False on timeout or error.
+        """
+        try:
+            status = ieee488.wait_for_status(self.dmm, self.STATUS_DATA_READY,
+                                             timeout or self.completion_timeout(), self.use_srq)
+        except pyvisa.VisaIOError as e:
+            self.logger.error(f'Error polling the status byte: {e}')
+            return False
+        if status is None:
+            self.logger.error('Timed out waiting for a reading.')
+            return False
+        return True
+
     def get_reading(self):
+        # Query the integer scale factor before a reading is pending in the output buffer
+        if self.format in ('SINT', 'DINT') and self.get_scale() is None:
+            return None
         try:
             self.dmm.write(f'TARM\\sAUTO')
-            return float(self.dmm.read_bytes(16).decode().strip())
+            if not self.wait_for_data():
+                return None
+            if self.format == 'ASCII':
+                return float(self.dmm.read_bytes(self.ASCII_READING_BYTES).decode().strip())
+            readings = self.read_readings(1)
+            return None if readings is None else float(readings[0])
         except pyvisa.VisaIOError as e:
             self.logger.error(f'Error failed to get reading: {e}')
 
+    def get_scale(self):
+        """
+        Query the factor converting SINT/DINT readings to the units of the function.
+        The factor depends on function, range and resolution and is cached until one
+        of them is changed through the driver.
+
+        :return: Scale factor as float or None if an error occurs.
+        """
+        if self._scale is None:
+            try:
+                self.dmm.write('ISCALE?')
+                self._scale = float(self.dmm.read().strip())
+            except (pyvisa.VisaIOError, ValueError) as e:
+                self.logger.error(f'Error querying the integer scale factor: {e}')
+                return None
+        return self._scale
+
+    def read_readings(self, count=1, out=None):
+        """
+        Read a number of readings in the active output format and convert them to values
+        in the units of the function.
+
+        Binary formats are decoded in one vectorized pass, integer formats are scaled by
+        the ISCALE? factor. Autoranging changes the scale between readings, so use a
+        fixed range with SINT/DINT.
+
+        :param count: Number of readings to read.
+        :param out: Optional preallocated float64 array to write the values into.
+        :return: Numpy float64 array of the readings or None if an error occurs.
+        """
+        if out is None:
+            out = np.empty(count, dtype=np.float64)
+        values = out[:count]
+        if self.format == 'ASCII':
+            try:
+                data = self.dmm.read_bytes(count * self.ASCII_READING_BYTES).decode()
+                values[...] = np.array(data.replace(',', ' ').split(), dtype=np.float64)
+                return values
+            except (pyvisa.VisaIOError, ValueError) as e:
+                self.logger.error(f'Error reading ASCII readings: {e}')
+                return None
+
+        scale = 1.0
+        if self.format in ('SINT', 'DINT'):
+            scale = self.get_scale()
+            if scale is None:
+                return None
+            if self.range == 'AUTO':
+                self.logger.warning(f'{self.format} readings with autorange may be scaled inconsistently.')
+        raw = self.read_binary_readings(count)
+        if raw is None:
+            return None
+        np.multiply(raw, scale, out=values)
+        return values
+
+    def read_binary_readings(self, count=1, out=None):
+        """
+        Read a number of readings sent in the active binary output format.
+
+        The bytes are read straight into the array memory; no intermediate copy is made.
+
+        :param count: Number of readings to read.
+        :param out: Optional preallocated array of the format's dtype to read into.
+        :return: Numpy array view of the raw readings or None if an error occurs.
+        """
+        if self.format not in self.FORMAT_DTYPES:
+            self.logger.error(f'Binary read requested while the output format is {self.format}.')
+            return None
+        dtype = self.FORMAT_DTYPES[self.format]
+        if out is None:
+            out = np.empty(count, dtype=dtype)
+        try:
+            ieee488.read_exact_into(self.dmm, out[:count])
+            return out[:count]
+        except pyvisa.VisaIOError as e:
+            self.logger.error(f'Error reading binary readings: {e}')
+            return None
+
+    def configure_burst(self, n_readings, sample_event='TIMER', interval=None, trigger='AUTO',
+                        memory_format='SINT'):
+        """
+        Configure the meter to take a block of readings per trigger arm into its
+        reading memory (MEM FIFO).
+
+        :param n_readings: Number of readings per trigger (NRDGS).
+        :param sample_event: Event starting each reading after the first, one of SAMPLE_EVENTS.
+        :param interval: Sample timer interval in seconds when sample_event is 'TIMER'.
+                         Defaults to the fastest rate of the integration time.
+        :param trigger: Trigger event, one of TRIGGER_EVENTS.
+        :param memory_format: Storage format of the readings, one of the binary FORMATS.
+                              SINT stores the most readings.
+        """
+        if sample_event not in self.SAMPLE_EVENTS:
+            self.logger.warning(f'Invalid sample event {sample_event}. Valid events: {self.SAMPLE_EVENTS}')
+            return
+        if trigger not in self.TRIGGER_EVENTS:
+            self.logger.warning(f'Invalid trigger event {trigger}. Valid events: {self.TRIGGER_EVENTS}')
+            return
+        if memory_format not in self.FORMATS:
+            self.logger.warning(f'Invalid memory format {memory_format}. Valid formats: {self.FORMATS}')
+            return
+        try:
+            self.dmm.write('TARM\\sHOLD')
+            self.dmm.write(f'MFORMAT\\s{memory_format}')
+            self.dmm.write('MEM\\sFIFO')
+            if sample_event == 'TIMER':
+                interval = interval if interval is not None else self.integration_time()
+                self.dmm.write(f'TIMER\\s{interval}')
+            self.dmm.write(f'NRDGS\\s{n_readings},{sample_event}')
+            self.dmm.write(f'TRIG\\s{trigger}')
+            self.n_readings = n_readings
+            self.sample_event = sample_event
+            self.sample_interval = interval if sample_event == 'TIMER' else None
+            self._configuration_changed()
+            self.logger.info(f'Burst of {n_readings} readings configured '
+                             f'(sample event {sample_event}, trigger {trigger}).')
+        except pyvisa.VisaIOError as e:
+            self.logger.error(f'Error configuring burst acquisition: {e}')
+
+    def get_memory_count(self, timeout=None):
+        """
+        Query the number of readings stored in memory. The meter answers once the
+        running measurement has finished, so this also waits for a burst to complete.
+
+        :param timeout: Upper bound of the waiting time in seconds. Defaults to the VISA timeout.
+        :return: Number of readings or None if an error occurs.
+        """
+        try:
+            with ieee488.timeout_set(self.dmm, timeout or self.dmm.timeout / 1000):
+                self.dmm.write('MCOUNT?')
+                return int(float(self.dmm.read().strip()))
+        except (pyvisa.VisaIOError, ValueError) as e:
+            self.logger.error(f'Error querying the memory count: {e}')
+            return None
+
+    def recall_readings(self, count, first=1, out=None):
+        """
+        Recall stored readings in one bulk transfer (RMEM) in the active output format.
+
+        :param count: Number of readings to recall.
+        :param first: Number of the first reading (1 is the oldest in FIFO mode).
+        :param out: Optional preallocated float64 array to write the values into.
+        :return: Numpy float64 array of the readings or None if an error occurs.
+        """
+        if self.format in ('SINT', 'DINT') and self.get_scale() is None:
+            return None
+        try:
+            self.dmm.write(f'RMEM\\s{first},{count},1')
+        except pyvisa.VisaIOError as e:
+            self.logger.error(f'Error recalling readings: {e}')
+            return None
+        return self.read_readings(count, out)
+
+    def acquire_burst(self, timeout=None, out=None):
+        """
+        Arm once, take the configured block of readings into memory and recall them.
+
+        Use a binary output format (set_format) for the transfer; SINT/DINT are scaled
+        with the ISCALE? factor.
+
+        :param timeout: Upper bound of the acquisition time in seconds. Defaults to
+                        completion_timeout() of the burst; set it for external triggers.
+        :param out: Optional preallocated float64 array to write the values into.
+        :return: Numpy float64 array of the readings or None if an error occurs.
+        """
+        n_readings = self.n_readings
+        try:
+            self.dmm.write('MEM\\sFIFO')  # Clears the reading memory
+            self.dmm.write('TARM\\sSGL')
+        except pyvisa.VisaIOError as e:
+            self.logger.error(f'Error arming the burst: {e}')
+            return None
+        count = self.get_memory_count(timeout or self.completion_timeout(n_readings))
+        if count is None:
+            return None
+        if count < n_readings:
+            self.logger.warning(f'Only {count} of {n_readings} readings stored.')
+        if count == 0:
+            return np.empty(0, dtype=np.float64)
+        return self.recall_readings(count, out=out)
+
     def set_beeper_status(self, status='OFF'):
         if status in self.BEEPER_STATUS:
             try:
@@ -175,6 +599,9 @@ class HP3457A:
         if function in self.FUNCTIONS:
             try:
                 self.dmm.write(f"FUNC\\s{function}")
+                self.function = function
+                self.range = 'AUTO'  # FUNC without a range argument selects autorange
+                self._configuration_changed()
                 self.logger.info(f"Measurement function set to {function}")
             except pyvisa.VisaIOError as e:
                 self.logger.error(f"Error setting measurement function: {e}")
@@ -211,7 +638,8 @@ class HP3457A:
         """
         if self.dmm:
             try:
-                self.dmm.close()
+                release_resource(self.rm, self.dmm)
+                self.dmm = None
                 self.logger.info("Connection to the digital multimeter closed.")
             except pyvisa.VisaIOError as e:
                 self.logger.error(f"Error closing connection to the multimeter: {e}")
@@ -219,7 +647,6 @@ class HP3457A:
 
 # Example usage
 if __name__ == "__main__":
-    rm = pyvisa.ResourceManager()
     dmm = HP3457A("visa://192.168.194.15/GPIB1::22::INSTR")
     dmm.set_format('ASCII')
     dmm.set_beeper_status('ONCE')
@@ -11,8 +11,55 @@ Date Updated: 2024-10-02
 
 import pyvisa
 import numpy as np
-import struct
 import logging
+import time
+
+import ieee488
+from waveform import TimeAxis, RawWaveform, decimate
+from visa_session import get_session_manager, get_idn, release_resource
+
+
+# Layout of the WAVEDESC waveform descriptor returned by :WAV:PRE? (little-endian).
+# Only the fields used by the driver are described; the rest of the 346 bytes is skipped.
+WAVEDESC_DTYPE = np.dtype({
+    'names': ['num_points', 'first_point', 'data_interval', 'read_frames', 'sum_frames',
+              'vertical_gain', 'vertical_offset', 'code_per_div', 'adc_bit',
+              'sequence_frame_idx', 'horizontal_interval', 'horizontal_offset',
+              'timebase_idx', 'vertical_coupling_idx', 'probe_attenuation', 'bw_limit',
+              'source_channel'],
+    'formats': ['<i4', '<i4', '<i4', '<i4', '<i4',
+                '<f4', '<f4', '<f4', '<i2',
+                '<i2', '<f4', '<f8',
+                '<i2', '<i2', '<f4', '<i2',
+                '<i2'],
+    'offsets': [116, 132, 136, 144, 148,
+                156, 160, 164, 172,
+                174, 176, 180,
+                324, 326, 328, 334,
+                344],
+    'itemsize': 346
+})
+
+
+class WaveformPreamble:
+    """A lightweight record of the decoded WAVEDESC waveform descriptor."""
+
+    __slots__ = WAVEDESC_DTYPE.names
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    @classmethod
+    def from_buffer(cls, buffer):
+        """
+        Decode a WAVEDESC descriptor in a single call.
+
+        :param buffer: Buffer holding the descriptor bytes (without the block header).
+        :return: WaveformPreamble instance.
+        """
+        return cls(*np.frombuffer(buffer, dtype=WAVEDESC_DTYPE, count=1)[0].item())
+
 
 class SDS814XHD:
     """A class for interfacing with the SDS814XHD oscilloscope."""
@@ -26,26 +73,59 @@ class SDS814XHD:
         200e-3, 500e-3, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000
     ]
 
-    def __init__(self, resource_name, alias='SDS814XHD', log_level='INFO'):
+    # When get_waveform(update=True) re-reads the preamble:
+    #   'always' - on every call,
+    #   'cached' - only after the driver changed a setting the preamble depends on,
+    #   'status' - as 'cached', plus when *ESR? reports a front panel user request.
+    PREAMBLE_POLICIES = ['always', 'cached', 'status']
+
+    ESR_USER_REQUEST = 0x40  # URQ bit of the standard event status register
+
+    AVERAGE_COUNTS = [4, 16, 32, 64, 128, 256, 512, 1024]
+
+    ERES_BITS = [0.5, 1.0, 1.5, 2.0, 2.5, 3.0]
+
+    # Waveform transfer width: 'auto' uses BYTE when the ADC resolution fits in 8 bits
+    WIDTH_POLICIES = ['auto', 'byte', 'word']
+
+    def __init__(self, resource_name, alias='SDS814XHD', log_level='INFO', preamble_policy='status',
+                 width_policy='auto', visa_rm=None):
         """
         Initialize the oscilloscope class and establish connection.
 
         :param resource_name: VISA resource name for the oscilloscope.
         :param alias: Alias for logging.
         :param log_level: Level of logging.
+        :param preamble_policy: One of PREAMBLE_POLICIES. Default 'status'.
+        :param width_policy: One of WIDTH_POLICIES. Default 'auto'.
+        :param visa_rm: VisaSessionManager or pyvisa.ResourceManager. Defaults to the shared
+                        session manager.
         """
         self.LOG_FORMAT = f'%(asctime)s [%(levelname)s] {alias}: %(message)s'
         self.logger = logging.getLogger(__name__)
         logging.basicConfig(format=self.LOG_FORMAT, level=log_level)
         self.scope_address = resource_name
+        if preamble_policy not in self.PREAMBLE_POLICIES:
+            self.logger.warning(f"Invalid preamble policy '{preamble_policy}'. "
+                                f"Valid policies: {', '.join(self.PREAMBLE_POLICIES)}. Using 'always'.")
+            preamble_policy = 'always'
+        self.preamble_policy = preamble_policy
+        if width_policy not in self.WIDTH_POLICIES:
+            self.logger.warning(f"Invalid width policy '{width_policy}'. "
+                                f"Valid policies: {', '.join(self.WIDTH_POLICIES)}. Using 'word'.")
+            width_policy = 'word'
+        self.width_policy = width_policy
+        self._transfer_width = None
+        self.channel = None
+        self._preamble_cache = {}
 
         try:
-            self.rm = pyvisa.ResourceManager()
+            self.rm = visa_rm if visa_rm is not None else get_session_manager()
             self.oscilloscope = self.rm.open_resource(self.scope_address)
             self.oscilloscope.timeout = 3000
             self.logger.info(f"Connection established with the SDS814X HD oscilloscope."
                              f"\n\tResource address: {self.scope_address}"
-                             f'\n\tID: {self.get_idn()}')
+                             f'\n\tID: {get_idn(self.rm, self.scope_address, self.get_idn)}')
             self.read_preamble()
         except pyvisa.VisaIOError as e:
             self.logger.error(f'Failed to connect to the oscilloscope.\n\t{e}')
@@ -94,6 +174,7 @@ class SDS814XHD:
         if self.is_valid_channel(channel):
             try:
                 self.oscilloscope.write(f'WAV:SOUR {channel}')
+                self.channel = channel
                 self.logger.info(f"Active channel: {channel}")
             except pyvisa.VisaIOError as e:
                 self.logger.error(f"Failed to set channel: {e}")
@@ -107,6 +188,130 @@ class SDS814XHD:
             return 1
         return 0
 
+    def set_timebase(self, timebase):
+        """
+        Set the horizontal scale of the oscilloscope.
+
+        :param timebase: Time per division in seconds, one of TIMEBASE_LIST.
+        :return: Returns 0 if successful, 1 if ended with error.
+        """
+        if timebase not in self.TIMEBASE_LIST:
+            self.logger.warning(f"Invalid timebase {timebase} s. "
+                                f"Valid values: {self.TIMEBASE_LIST}.")
+            return 1
+        try:
+            self.oscilloscope.write(f':TIM:SCAL {timebase:.3E}')
+            self.invalidate_preamble()
+            self.logger.info(f"Timebase set to {timebase} s/div")
+        except pyvisa.VisaIOError as e:
+            self.logger.error(f"Failed to set timebase: {e}")
+            return 1
+        return 0
+
+    def set_vertical_scale(self, scale, channel=None):
+        """
+        Set the vertical scale of an analog channel.
+
+        :param scale: Volts per division.
+        :param channel: Channel C1..C4. Defaults to the active channel.
+        :return: Returns 0 if successful, 1 if ended with error.
+        """
+        channel = channel or self.channel
+        if channel not in self.VALID_CHANNELS[:4]:
+            self.logger.warning(f"Invalid analog channel name '{channel}'. "
+                                f"Valid channels: {', '.join(self.VALID_CHANNELS[:4])}.")
+            return 1
+        try:
+            self.oscilloscope.write(f':CHAN{channel[1]}:SCAL {scale:.3E}')
+            self.invalidate_preamble(channel)
+            self.logger.info(f"Vertical scale of {channel} set to {scale} V/div")
+        except pyvisa.VisaIOError as e:
+            self.logger.error(f"Failed to set vertical scale: {e}")
+            return 1
+        return 0
+
+    def set_memory_depth(self, depth):
+        """
+        Set the acquisition memory depth, i.e. the number of acquired points.
+
+        :param depth: Memory depth string accepted by the oscilloscope, e.g. '10k' or '10M'.
+        :return: Returns 0 if successful, 1 if ended with error.
+        """
+        try:
+            self.oscilloscope.write(f':ACQ:MDEP {depth}')
+            self.invalidate_preamble()
+            self.logger.info(f"Memory depth set to {depth}")
+        except pyvisa.VisaIOError as e:
+            self.logger.error(f"Failed to set memory depth: {e}")
+            return 1
+        return 0
+
+    def _set_acquisition_type(self, acquisition_type):
+        """
+        Send an :ACQuire:TYPE setting and drop the cached preambles.
+
+        :param acquisition_type: Argument of the :ACQuire:TYPE command.
+        :return: Returns 0 if successful, 1 if ended with error.
+        """
+        try:
+            self.oscilloscope.write(f':ACQ:TYPE {acquisition_type}')
+            self.invalidate_preamble()
+            self.logger.info(f"Acquisition type set to {acquisition_type}")
+        except pyvisa.VisaIOError as e:
+            self.logger.error(f"Failed to set acquisition type: {e}")
+            return 1
+        return 0
+
+    def set_averaging(self, num_averages):
+        """
+        Average acquisitions on the oscilloscope instead of transferring every trace.
+
+        Averaging accumulates over consecutive triggers, so the oscilloscope should be
+        running (not in single mode) while the average builds up.
+
+        :param num_averages: Number of averaged acquisitions, one of AVERAGE_COUNTS.
+                             1 returns to normal acquisition.
+        :return: Returns 0 if successful, 1 if ended with error.
+        """
+        if num_averages == 1:
+            return self._set_acquisition_type('NORM')
+        if num_averages not in self.AVERAGE_COUNTS:
+            self.logger.warning(f"Invalid number of averages {num_averages}. "
+                                f"Valid values: {self.AVERAGE_COUNTS}.")
+            return 1
+        return self._set_acquisition_type(f'AVER,{num_averages}')
+
+    def set_eres(self, bits):
+        """
+        Enable enhanced resolution (ERES) filtering on the oscilloscope.
+
+        :param bits: Resolution enhancement in bits, one of ERES_BITS.
+        :return: Returns 0 if successful, 1 if ended with error.
+        """
+        if bits not in self.ERES_BITS:
+            self.logger.warning(f"Invalid ERES enhancement {bits}. Valid values: {self.ERES_BITS}.")
+            return 1
+        return self._set_acquisition_type(f'ERES,{bits:.1f}')
+
+    def set_sparsing(self, interval=1):
+        """
+        Transfer only every interval-th point of the record (:WAV:INTerval).
+
+        :param interval: Sparsing interval. 1 transfers every point.
+        :return: Returns 0 if successful, 1 if ended with error.
+        """
+        if int(interval) < 1:
+            self.logger.warning(f"Invalid sparsing interval {interval}. It must be 1 or larger.")
+            return 1
+        try:
+            self.oscilloscope.write(f':WAV:INT {int(interval)}')
+            self.invalidate_preamble()
+            self.logger.info(f"Waveform sparsing interval set to {int(interval)}")
+        except pyvisa.VisaIOError as e:
+            self.logger.error(f"Failed to set sparsing interval: {e}")
+            return 1
+        return 0
+
     def get_number_of_points(self):
         """
         Retrieve the number of sampled points of the current waveform.
@@ -119,6 +324,18 @@ class SDS814XHD:
             self.logger.error(f'Error retrieving the number of points: {e}')
             return None
 
+    def _apply_preamble(self, preamble):
+        """
+        Make a decoded preamble the one used for waveform conversion.
+
+        :param preamble: WaveformPreamble instance.
+        """
+        self.preamble = preamble
+        for name in WaveformPreamble.__slots__:
+            setattr(self, name, getattr(preamble, name))
+        self.timebase = self.TIMEBASE_LIST[self.timebase_idx]
+        self.channel = self.VALID_CHANNELS[self.source_channel]
+
     def read_preamble(self):
         """
         Read and parse the preamble string to extract waveform parameters.
@@ -126,38 +343,65 @@ class SDS814XHD:
         try:
             self.logger.debug('Requesting preamble from the oscilloscope.')
             self.oscilloscope.write(':WAV:PRE?')
-            preamble = self.oscilloscope.read_raw()
-            n_skip = 11  # Skip header bits
+            preamble = ieee488.read_block(self.oscilloscope)
             self.logger.debug('Unpacking the preamble bitstream.')
+            self._apply_preamble(WaveformPreamble.from_buffer(preamble))
+            self._preamble_cache[self.channel] = self.preamble
 
-
-            self.num_points = struct.unpack('l', preamble[n_skip+116:n_skip+120])[0]
-            self.first_point = struct.unpack('l', preamble[n_skip+132:n_skip+136])[0]
-            self.data_interval = struct.unpack('l', preamble[n_skip+136:n_skip+140])[0]
-            self.read_frames = struct.unpack('l', preamble[n_skip+144:n_skip+148])[0]
-            self.sum_frames = struct.unpack('l', preamble[n_skip+148:n_skip+152])[0]
-            self.vertical_gain = struct.unpack('f', preamble[n_skip+156:n_skip+160])[0]
-            self.vertical_offset = struct.unpack('f', preamble[n_skip+160:n_skip+164])[0]
-            self.code_per_div = struct.unpack('f', preamble[n_skip+164:n_skip+168])[0]
-            self.adc_bit = struct.unpack('h', preamble[n_skip+172:n_skip+174])[0]
-            self.sequence_frame_idx = struct.unpack('h', preamble[n_skip+174:n_skip+176])[0]
-            self.horizontal_interval = struct.unpack('f', preamble[n_skip+176:n_skip+180])[0]
-            self.horizontal_offset = struct.unpack('d', preamble[n_skip+180:n_skip+188])[0]
-            self.timebase_idx = struct.unpack('h', preamble[n_skip+324:n_skip+326])[0]
-            self.vertical_coupling_idx = struct.unpack('h', preamble[n_skip+326:n_skip+328])[0]
-            self.probe_attenuation = struct.unpack('f', preamble[n_skip+328:n_skip+332])[0]
-            self.bw_limit = struct.unpack('h', preamble[n_skip+334:n_skip+336])[0]
-            self.source_channel = struct.unpack('h', preamble[n_skip+344:n_skip+346])[0]
-
-            self.timebase = self.TIMEBASE_LIST[self.timebase_idx]
             self.logger.debug(f'First point: {self.first_point}, '
                               f'Number of points: {self.num_points}, '
                               f'Data interval: {self.data_interval}, '
                               f'Frames read: {self.read_frames}')
             self.logger.info('Preamble updated.')
-        except pyvisa.VisaIOError as e:
+        except (pyvisa.VisaIOError, ValueError) as e:
             self.logger.error(f'Error retrieving the preamble: {e}')
-    
+
+    def invalidate_preamble(self, channel=None):
+        """
+        Drop cached preambles so that the next update re-reads them from the oscilloscope.
+
+        :param channel: Channel whose preamble is dropped. All channels if None.
+        """
+        if channel is None:
+            self._preamble_cache.clear()
+        else:
+            self._preamble_cache.pop(channel, None)
+        # The transfer width may have been changed too (front panel, another driver
+        # sharing the session), so set it again before the next transfer
+        self._transfer_width = None
+
+    def _front_panel_changed(self):
+        """
+        Check (and clear) the user request bit of the standard event status register.
+
+        :return: True if the front panel was touched or the status could not be read.
+        """
+        try:
+            return bool(int(self.oscilloscope.query('*ESR?').strip()) & self.ESR_USER_REQUEST)
+        except (pyvisa.VisaIOError, ValueError) as e:
+            self.logger.warning(f'Error reading the event status register: {e}')
+            return True
+
+    def update_preamble(self):
+        """
+        Bring the waveform parameters up to date according to the preamble policy.
+
+        A cached preamble of the active channel is reused unless the policy or a
+        settings change requires a new :WAV:PRE? query.
+        """
+        if self.preamble_policy == 'always':
+            self.read_preamble()
+            return
+        if self.preamble_policy == 'status' and self._front_panel_changed():
+            self.logger.debug('Front panel change detected.')
+            self.invalidate_preamble()
+        cached = self._preamble_cache.get(self.channel)
+        if cached is None:
+            self.read_preamble()
+        elif cached is not self.preamble:
+            self._apply_preamble(cached)
+            self.logger.debug(f'Using cached preamble of {self.channel}.')
+
     def get_preamble_dict(self):
         """
         Form a dictionary from the oscilloscope parameters after reading the preamble.
@@ -186,68 +430,467 @@ class SDS814XHD:
             'Source channel name': self.VALID_CHANNELS[self.source_channel]
         }
 
+    def get_sample_interval(self):
+        """
+        Effective interval between transferred points, including the :WAV:INTerval sparsing.
+
+        :return: Sample interval in seconds.
+        """
+        return self.horizontal_interval * max(self.data_interval, 1)
+
+    def get_transfer_points(self):
+        """
+        Number of points a full-record transfer returns with the current sparsing.
+
+        :return: Integer number of points.
+        """
+        return -(-self.num_points // max(self.data_interval, 1))
+
+    def get_transfer_info(self):
+        """
+        Update the preamble and report what the next transfer will return.
+
+        :return: Tuple of the effective sample interval in seconds and the number of points.
+        """
+        self.update_preamble()
+        return self.get_sample_interval(), self.get_transfer_points()
+
+    def _time_data(self, num_points=None):
+        """
+        Create the time axis of the current waveform from the preamble.
+
+        :param num_points: Number of transferred points. Defaults to get_transfer_points().
+        :return: TimeAxis that computes time samples on demand.
+        """
+        horizontal_grid_num = 10  # Specific for SDS800X HD model line
+        if num_points is None:
+            num_points = self.get_transfer_points()
+        return TimeAxis(self.horizontal_offset - 0.5 * horizontal_grid_num * self.timebase,
+                        self.get_sample_interval(),
+                        num_points)
+
     def _convert_data(self, raw_values):
         """
         Convert raw waveform data to voltage samples and create time samples.
 
         :param raw_values: A bitstream of raw waveform values.
-        :return: Two arrays of time samples and voltage samples.
+        :return: Time axis (TimeAxis) and array of voltage samples.
         """
         if raw_values.size > 0:
-            horizontal_grid_num = 10  # Specific for SDS800X HD model line
-            voltage_levels = np.array(raw_values, dtype=np.float32)
-            voltage_data = (voltage_levels * (self.vertical_gain / self.code_per_div) 
-                            - self.vertical_offset)
-            time_data = (self.horizontal_offset 
-                         - 0.5 * horizontal_grid_num * self.timebase 
-                         + np.arange(self.num_points) * self.horizontal_interval)
+            # Scaled in place: one float32 array besides the codes
+            voltage_data = self._raw_waveform(raw_values).scale(raw_values)
+            time_data = self._time_data(raw_values.size)
             self.logger.debug('Conversion successful.')
             return time_data, voltage_data
         else:
             self.logger.error('Raw data conversion failed: empty bitstream.')
             return None
 
-    def get_waveform(self, update=True):
+    def _raw_waveform(self, raw_values):
         """
-        Retrieve waveform data from the selected channel.
+        Wrap raw waveform codes with the voltage scaling of the current preamble.
 
-        :param update: If true, update oscilloscope parameters.
-        :return: Two numpy arrays of time and voltage readings.
+        :param raw_values: Array of raw waveform codes.
+        :return: RawWaveform instance.
         """
-        if not self.oscilloscope:
-            self.logger.error(f"Oscilloscope not connected. Resource: {self.scope_address}")
+        return RawWaveform(raw_values, self.vertical_gain / self.code_per_div, self.vertical_offset)
+
+    def get_max_transfer_points(self):
+        """
+        Retrieve the maximum number of points the oscilloscope returns per :WAV:DATA? query.
+
+        :return: Integer number of points or None if there was an error.
+        """
+        try:
+            return int(float(self.oscilloscope.query(':WAV:MAXP?').strip()))
+        except pyvisa.VisaIOError as e:
+            self.logger.error(f'Error retrieving the maximum transfer size: {e}')
             return None
 
-        if update:
-            self.read_preamble()
+    def _select_width(self):
+        """
+        Choose the waveform transfer width according to the width policy.
+
+        :return: 'BYTE' or 'WORD'.
+        """
+        if self.width_policy == 'byte':
+            return 'BYTE'
+        if self.width_policy == 'auto' and getattr(self, 'adc_bit', 16) <= 8:
+            return 'BYTE'
+        return 'WORD'
+
+    def _set_transfer_width(self, width):
+        """
+        Set the waveform transfer width, skipping the command if it is unchanged.
+
+        :param width: 'BYTE' or 'WORD'.
+        """
+        if width != self._transfer_width:
+            self.oscilloscope.write(f':WAV:WIDT {width}')
+            self._transfer_width = width
+            self.logger.debug(f'Set data format to {width}.')
+
+    def _widen_codes(self, byte_values, out):
+        """
+        Convert 8-bit transfer codes to the int16 codes of a WORD transfer.
+
+        When the ADC resolution exceeds 8 bits, BYTE transfers carry the most
+        significant bits, so the codes are shifted back to the ADC scale.
+
+        :param byte_values: Array of int8 codes.
+        :param out: Int16 array to write into, at least as long as byte_values.
+        :return: View of out holding the int16 codes.
+        """
+        raw_values = out[:byte_values.size]
+        raw_values[...] = byte_values
+        shift = getattr(self, 'adc_bit', 8) - 8
+        if shift > 0:
+            raw_values <<= shift
+        return raw_values
+
+    def _read_waveform_codes(self, chunk_points=None, out=None, width='WORD'):
+        """
+        Transfer the raw waveform codes into a single preallocated int16 array.
 
+        :param chunk_points: Number of points per :WAV:STARt/:WAV:POINt window.
+                             If None, the record is transferred as one block.
+        :param out: Optional preallocated int16 array to read into.
+        :param width: Active transfer width, 'BYTE' or 'WORD'.
+        :return: Numpy int16 array of raw codes.
+        """
+        # A block of another size means the oscilloscope uses a different width
+        itemsize = 1 if width == 'BYTE' else 2
         try:
-            self.oscilloscope.write(':WAV:WIDT WORD')  # Set to 16-bit words
-            self.logger.debug('Set data format to 16-bit words.')
+            return self._read_codes(chunk_points, out, width, itemsize)
+        except ValueError:
+            self._transfer_width = None  # Set the width again on the next transfer
+            raise
 
+    def _read_codes(self, chunk_points, out, width, itemsize):
+        """
+        Transfer helper of _read_waveform_codes(); checks every block against the
+        transfer geometry.
+        """
+        if chunk_points is None:
+            expected_bytes = self.get_transfer_points() * itemsize
             self.oscilloscope.write(':WAV:DATA?')
             self.logger.debug('Requested waveform data.')
+            if width == 'BYTE':
+                byte_values = ieee488.read_block(self.oscilloscope, dtype=np.int8,
+                                                 expected_bytes=expected_bytes)
+                if out is None:
+                    out = np.empty(byte_values.size, dtype=np.int16)
+                raw_values = self._widen_codes(byte_values, out)
+            else:
+                raw_values = ieee488.read_block(self.oscilloscope, dtype=np.int16, out=out,
+                                                expected_bytes=expected_bytes)
+            self.logger.debug(f'Received raw bitstream: {raw_values.size} points.')
+            return raw_values
+
+        num_points = self.get_transfer_points()
+        sparsing = max(self.data_interval, 1)
+        raw_values = np.empty(num_points, dtype=np.int16) if out is None else out
+        staging = np.empty(min(chunk_points, num_points), dtype=np.int8) if width == 'BYTE' else None
+        try:
+            start = 0
+            while start < num_points:
+                window = min(chunk_points, num_points - start)
+                # :WAV:STARt counts acquired points, :WAV:POINt counts transferred points
+                self.oscilloscope.write(f':WAV:STAR {start * sparsing}')
+                self.oscilloscope.write(f':WAV:POIN {window}')
+                self.oscilloscope.write(':WAV:DATA?')
+                if staging is None:
+                    received = ieee488.read_block(self.oscilloscope, out=raw_values[start:],
+                                                  expected_bytes=window * itemsize).size
+                else:
+                    byte_values = ieee488.read_block(self.oscilloscope, out=staging,
+                                                     expected_bytes=window * itemsize)
+                    received = self._widen_codes(byte_values, raw_values[start:]).size
+                if received == 0:
+                    break
+                start += received
+            self.logger.debug(f'Received {start} points in chunks of {chunk_points}.')
+        finally:
+            # Restore the full-record window for subsequent transfers
+            self.oscilloscope.write(':WAV:STAR 0')
+            self.oscilloscope.write(':WAV:POIN 0')
+        return raw_values[:start]
+
+    def get_waveform(self, update=True, chunk_points=None, raw=False, out=None):
+        """
+        Retrieve waveform data from the selected channel.
 
-            raw_data = self.oscilloscope.read_raw().rstrip()
-            self.logger.debug(f'Received raw bitstream: {len(raw_data)} bytes.')
+        :param update: If true, update oscilloscope parameters (see PREAMBLE_POLICIES).
+        :param chunk_points: If given, transfer the record in windows of this many points
+                             to keep peak memory near the size of one record. Pass 0 to use
+                             the maximum window the oscilloscope allows (:WAV:MAXP?).
+        :param raw: If true, return the int16 codes with their scaling (RawWaveform)
+                    instead of converting them to volts.
+        :param out: Optional preallocated int16 array to transfer the codes into. With raw
+                    true, the returned codes are a view of it.
+        :return: Time axis (TimeAxis, convertible with np.asarray) and numpy array of
+                 voltage readings (or RawWaveform if raw is true).
+        """
+        if not self.oscilloscope:
+            self.logger.error(f"Oscilloscope not connected. Resource: {self.scope_address}")
+            return None
 
-            num_digits = int(struct.unpack('c', raw_data[1:2])[0])
+        if update:
+            self.update_preamble()
 
-            raw_values = np.frombuffer(raw_data, offset=num_digits + 2, dtype=np.int16)
+        try:
+            width = self._select_width()
+            self._set_transfer_width(width)
+
+            if chunk_points == 0:
+                chunk_points = self.get_max_transfer_points()
+
+            raw_values = self._read_waveform_codes(chunk_points, out=out, width=width)
             self.logger.info('Waveform data retrieved.')
+            if raw:
+                return self._time_data(raw_values.size), self._raw_waveform(raw_values)
             return self._convert_data(raw_values)
 
         except (pyvisa.VisaIOError, ValueError) as e:
             self.logger.error(f"Error retrieving waveform data: {e}")
             return None
 
+    def get_envelope(self, n_bins=2000, **kwargs):
+        """
+        Retrieve a waveform reduced to a fixed-size min/max/mean envelope.
+
+        The reduction runs on the int16 codes; only the envelope is ever scaled to volts.
+
+        :param n_bins: Maximum number of envelope bins.
+        :param kwargs: Further keyword arguments passed to get_waveform().
+        :return: Envelope instance or None if an error occurs.
+        """
+        result = self.get_waveform(raw=True, **kwargs)
+        if result is None:
+            return None
+        return decimate(*result, n_bins=n_bins)
+
+    def wait_for_trigger(self, timeout=10.0, poll_interval=0.01):
+        """
+        Arm a single acquisition and wait until the oscilloscope has triggered and stopped.
+
+        :param timeout: Maximum waiting time in seconds.
+        :param poll_interval: Time between trigger status queries in seconds.
+        :return: True if the acquisition completed, False on timeout or error.
+        """
+        try:
+            self.oscilloscope.write(':TRIG:MODE SING')
+            self.logger.debug('Single acquisition armed.')
+            deadline = time.monotonic() + timeout
+            while time.monotonic() < deadline:
+                if self.oscilloscope.query(':TRIG:STAT?').strip().upper() == 'STOP':
+                    return True
+                time.sleep(poll_interval)
+            self.logger.warning(f'No trigger within {timeout} s.')
+        except pyvisa.VisaIOError as e:
+            self.logger.error(f'Error waiting for the trigger: {e}')
+        return False
+
+    def acquire_channels(self, channels=('C1', 'C2', 'C3', 'C4'), timeout=10.0, chunk_points=None):
+        """
+        Capture several channels from the same single-shot acquisition.
+
+        The oscilloscope is armed once, and after it stops every requested channel is
+        transferred from the stopped acquisition into one contiguous 2-D array.
+
+        :param channels: Sequence of channel names to read.
+        :param timeout: Maximum time to wait for the trigger in seconds.
+        :param chunk_points: Transfer window size, see get_waveform.
+        :return: TimeAxis shared by all channels and a (n_channels, n_points) voltage
+                 array, or None if an error occurs.
+        """
+        if not self.oscilloscope:
+            self.logger.error(f"Oscilloscope not connected. Resource: {self.scope_address}")
+            return None
+        invalid = [channel for channel in channels if not self.is_valid_channel(channel)]
+        if invalid or not channels:
+            self.logger.error(f"Invalid channel names {invalid}. "
+                              f"Valid channels: {', '.join(self.VALID_CHANNELS)}.")
+            return None
+
+        if not self.wait_for_trigger(timeout):
+            return None
+
+        active_channel = self.channel
+        try:
+            if chunk_points == 0:
+                chunk_points = self.get_max_transfer_points()
+            voltage_data = None
+            raw_values = None
+            for row, channel in enumerate(channels):
+                self.oscilloscope.write(f'WAV:SOUR {channel}')
+                self.channel = channel
+                self.update_preamble()
+                if voltage_data is None:
+                    num_points = self.get_transfer_points()
+                    time_data = self._time_data(num_points)
+                    voltage_data = np.empty((len(channels), num_points), dtype=np.float32)
+                    raw_values = np.empty(num_points, dtype=np.int16)
+                elif self.get_transfer_points() != num_points:
+                    raise ValueError(f'{channel} has {self.get_transfer_points()} points, '
+                                     f'expected {num_points}.')
+                width = self._select_width()
+                self._set_transfer_width(width)
+                codes = self._read_waveform_codes(chunk_points, out=raw_values, width=width)
+                voltage_data[row, :codes.size] = codes
+                voltage_data[row] *= self.vertical_gain / self.code_per_div
+                voltage_data[row] -= self.vertical_offset
+            self.logger.info(f"Acquired channels: {', '.join(channels)}.")
+            return time_data, voltage_data
+        except (pyvisa.VisaIOError, ValueError) as e:
+            self.logger.error(f"Error acquiring channels: {e}")
+            return None
+        finally:
+            if active_channel and active_channel != self.channel:
+                self.set_channel(active_channel)
+
+    def set_sequence(self, n_segments):
+        """
+        Configure segmented (sequence) acquisition.
+
+        :param n_segments: Number of segments captured per acquisition. 0 or None disables
+                           the sequence mode.
+        :return: Returns 0 if successful, 1 if ended with error.
+        """
+        try:
+            if n_segments:
+                self.oscilloscope.write(':ACQ:SEQ ON')
+                self.oscilloscope.write(f':ACQ:SEQ:COUN {int(n_segments)}')
+                self.logger.info(f"Sequence mode enabled with {n_segments} segments.")
+            else:
+                self.oscilloscope.write(':ACQ:SEQ OFF')
+                self.logger.info("Sequence mode disabled.")
+            self.invalidate_preamble()
+        except pyvisa.VisaIOError as e:
+            self.logger.error(f"Failed to configure sequence mode: {e}")
+            return 1
+        return 0
+
+    @staticmethod
+    def _parse_history_time(time_string):
+        """
+        Convert a :HISTORy:TIME? reply of the form '[-]hh:mm:ss.ffffff' to seconds.
+
+        :param time_string: Reply string.
+        :return: Time in seconds.
+        """
+        time_string = time_string.strip()
+        sign = -1.0 if time_string.startswith('-') else 1.0
+        hours, minutes, seconds = time_string.lstrip('+-').split(':')
+        return sign * (int(hours) * 3600 + int(minutes) * 60 + float(seconds))
+
+    def get_frame_timestamps(self, n_frames):
+        """
+        Read the trigger time stamps of the stored frames from the history.
+
+        :param n_frames: Number of frames, starting at frame 1.
+        :return: Array of trigger times in seconds, relative to the oscilloscope's time origin.
+        """
+        timestamps = np.empty(n_frames, dtype=np.float64)
+        self.oscilloscope.write(':HISTOR ON')
+        try:
+            for frame in range(n_frames):
+                self.oscilloscope.write(f':HISTOR:FRAM {frame + 1}')
+                timestamps[frame] = self._parse_history_time(self.oscilloscope.query(':HISTOR:TIME?'))
+        finally:
+            self.oscilloscope.write(':HISTOR OFF')
+        return timestamps
+
+    def get_sequence_frames(self, n_frames=None, timestamps=True, raw=False):
+        """
+        Bulk-download the frames of a stopped sequence acquisition.
+
+        Frames are requested with :WAV:SEQuence so that each :WAV:DATA? transfer
+        returns as many frames as the oscilloscope allows in one block.
+
+        :param n_frames: Number of frames to read. Defaults to all acquired frames.
+        :param timestamps: If true, also read the per-frame trigger time stamps.
+        :param raw: If true, return the int16 codes (RawWaveform) instead of volts.
+        :return: TimeAxis of a frame, (n_frames, n_points) array of voltages (or RawWaveform)
+                 and an array of trigger times (None if timestamps is false),
+                 or None if an error occurs.
+        """
+        if not self.oscilloscope:
+            self.logger.error(f"Oscilloscope not connected. Resource: {self.scope_address}")
+            return None
+        self._transfer_width = None  # Set the width once for every sequence transfer
+        try:
+            frames = None
+            start = 0
+            while frames is None or start < len(frames):
+                self.oscilloscope.write(f':WAV:SEQ 0,{start + 1}')
+                self.read_preamble()
+                if frames is None:
+                    n_frames = n_frames or self.sum_frames
+                    num_points = self.get_transfer_points()
+                    frames = np.empty((n_frames, num_points), dtype=np.int16)
+                    time_data = self._time_data(num_points)
+                width = self._select_width()
+                self._set_transfer_width(width)
+                out = frames[start:].reshape(-1)
+                self.oscilloscope.write(':WAV:DATA?')
+                if width == 'BYTE':
+                    byte_values = ieee488.read_block(self.oscilloscope, dtype=np.int8)
+                    received = self._widen_codes(byte_values[:out.size], out).size
+                else:
+                    # The scope sends every remaining frame; drop the ones beyond n_frames
+                    received = ieee488.read_block(self.oscilloscope, out=out, truncate=True).size
+                if received < num_points or received % num_points:
+                    raise ValueError(f'Incomplete sequence transfer at frame {start + 1}.')
+                start += received // num_points
+            self.logger.info(f'Sequence of {len(frames)} frames retrieved.')
+            trigger_times = self.get_frame_timestamps(len(frames)) if timestamps else None
+        except (pyvisa.VisaIOError, ValueError) as e:
+            self.logger.error(f"Error retrieving sequence frames: {e}")
+            return None
+        finally:
+            self.invalidate_preamble()
+        if raw:
+            return time_data, self._raw_waveform(frames), trigger_times
+        voltage_data = frames.astype(np.float32)
+        voltage_data *= self.vertical_gain / self.code_per_div
+        voltage_data -= self.vertical_offset
+        return time_data, voltage_data, trigger_times
+
+    def acquire_sequence(self, n_segments, timeout=10.0, timestamps=True, raw=False):
+        """
+        Capture a burst of n_segments triggers in sequence mode and download all frames.
+
+        :param n_segments: Number of segments to capture.
+        :param timeout: Maximum time to wait for all segments in seconds.
+        :param timestamps: If true, also read the per-frame trigger time stamps.
+        :param raw: If true, return the int16 codes (RawWaveform) instead of volts.
+        :return: See get_sequence_frames.
+
+        The sequence mode setting in effect before the call is restored afterwards, so
+        later get_waveform() and acquire_channels() calls are not segmented.
+        """
+        try:
+            enabled = self.oscilloscope.query(':ACQ:SEQ?').strip().upper() in ('ON', '1')
+            previous = int(float(self.oscilloscope.query(':ACQ:SEQ:COUN?'))) if enabled else 0
+        except (pyvisa.VisaIOError, ValueError) as e:
+            self.logger.warning(f'Error reading the sequence mode, it will be disabled afterwards: {e}')
+            previous = 0
+        try:
+            if self.set_sequence(n_segments) or not self.wait_for_trigger(timeout):
+                return None
+            return self.get_sequence_frames(n_segments, timestamps=timestamps, raw=raw)
+        finally:
+            self.set_sequence(previous)
+
     def close(self):
         """
         Close the connection to the oscilloscope.
         """
         if self.oscilloscope:
             try:
-                self.oscilloscope.close()
+                release_resource(self.rm, self.oscilloscope)
+                self.oscilloscope = None
                 self.logger.info("Connection to the oscilloscope closed.")
             except pyvisa.VisaIOError as e:
                 self.logger.error(f"Error closing connection: {e}")
@@ -13,6 +13,8 @@ import pyvisa
 import logging
 import time
 
+from visa_session import get_idn, release_resource
+
 
 class U1252B:
     """
@@ -26,6 +28,7 @@ class U1252B:
         """
         Initialize the Digital Multimeter class and establish a connection.
 
+        :param visa_rm: VisaSessionManager (shared sessions) or pyvisa.ResourceManager.
         :param resource_name: VISA resource name for the multimeter.
         :param alias: Alias for logging.
         :param log_level: Logging level (default: INFO).
@@ -35,11 +38,12 @@ class U1252B:
         logging.basicConfig(format=self.LOG_FORMAT, level=log_level)
 
         try:
+            self.rm = visa_rm
             self.dmm = visa_rm.open_resource(resource_address)
             self.dmm.timeout = 5000  # Set timeout to 5 seconds
             self.logger.info(f"Connection established with the digital multimeter."
                              f"\n\tResource address: {resource_address}"
-                             f'\n\tID: {self.get_idn()}')
+                             f'\n\tID: {get_idn(visa_rm, resource_address, self.get_idn)}')
         except pyvisa.VisaIOError as e:
             self.logger.error(f'Failed to connect to the digital multimeter.\n\t{e}')
             self.dmm = None
@@ -83,7 +87,8 @@ class U1252B:
         """
         if self.dmm:
             try:
-                self.dmm.close()
+                release_resource(self.rm, self.dmm)
+                self.dmm = None
                 self.logger.info("Connection to the digital multimeter closed.")
             except pyvisa.VisaIOError as e:
                 self.logger.error(f"Error closing connection to the multimeter: {e}")
@@ -0,0 +1,211 @@
+"""
+Module: Raw Capture Archive
+Description: This module provides an append-only archive of raw oscilloscope waveform codes.
+             Records are dumped back to back into a flat int16 binary file, and a compact
+             index file of fixed-size entries stores each record's offset, scaling, time axis
+             and timestamp. Readers memory-map both files for random access to any record.
+
+Author: Mykhailo Vorobiov
+Email: mvorobiov@wm.edu
+Date Created: 2024-10-15
+"""
+
+import logging
+import os
+import time
+
+import numpy as np
+
+from waveform import TimeAxis, RawWaveform
+
+# One index entry per record (little-endian, packed)
+INDEX_DTYPE = np.dtype([('offset', '<i8'),           # Position of the first sample in the data file
+                        ('num_points', '<i8'),
+                        ('timestamp', '<f8'),        # Capture time in seconds since the epoch
+                        ('gain', '<f8'),             # Volts per code
+                        ('vertical_offset', '<f8'),  # Volts subtracted after scaling
+                        ('time_start', '<f8'),       # Time of the first sample in seconds
+                        ('time_interval', '<f8'),    # Sampling interval in seconds
+                        ('source_channel', '<i2'),
+                        ('adc_bit', '<i2')])
+
+DATA_DTYPE = np.dtype('<i2')
+
+
+def archive_paths(path):
+    """
+    Build the data and index file names of an archive.
+
+    :param path: Archive base path (without extension).
+    :return: Tuple of the data file path and the index file path.
+    """
+    return f'{path}.bin', f'{path}.idx'
+
+
+class RawCaptureWriter:
+    """
+    Appends raw int16 waveform records to an archive.
+
+    The record data is written before its index entry, so after an interruption
+    the index only lists complete records; reopening the archive truncates any
+    trailing partial data and continues appending.
+    """
+
+    def __init__(self, path, log_level='INFO'):
+        """
+        :param path: Archive base path (without extension). Existing archives are appended to.
+        :param log_level: Level of logging.
+        """
+        self.logger = logging.getLogger(__name__)
+        logging.basicConfig(level=log_level)
+        self.path = path
+        data_path, index_path = archive_paths(path)
+
+        self.index_file = open(index_path, 'ab')
+        index_size = self.index_file.tell()
+        self.n_records = index_size // INDEX_DTYPE.itemsize
+        self.index_file.truncate(self.n_records * INDEX_DTYPE.itemsize)
+        self.index_file.seek(0, os.SEEK_END)
+
+        self.data_end = 0
+        if self.n_records:
+            last = np.fromfile(index_path, dtype=INDEX_DTYPE, count=1,
+                               offset=(self.n_records - 1) * INDEX_DTYPE.itemsize)[0]
+            self.data_end = int(last['offset'] + last['num_points'])
+            self.logger.info(f'Appending to {path} after {self.n_records} records.')
+        self.data_file = open(data_path, 'ab')
+        self.data_file.truncate(self.data_end * DATA_DTYPE.itemsize)
+        self.data_file.seek(0, os.SEEK_END)
+        self._entry = np.zeros(1, dtype=INDEX_DTYPE)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self.n_records
+
+    def append(self, time_data, raw_waveform, timestamp=None, source_channel=-1, adc_bit=0):
+        """
+        Append one record.
+
+        :param time_data: TimeAxis of the record.
+        :param raw_waveform: RawWaveform with the int16 codes and their scaling.
+        :param timestamp: Capture time in seconds since the epoch. Defaults to time.time().
+        :param source_channel: Source channel index from the preamble.
+        :param adc_bit: ADC resolution from the preamble.
+        """
+        codes = np.ascontiguousarray(raw_waveform.codes, dtype=DATA_DTYPE)
+        self.data_file.write(memoryview(codes).cast('B'))
+
+        entry = self._entry[0]
+        entry['offset'] = self.data_end
+        entry['num_points'] = codes.size
+        entry['timestamp'] = time.time() if timestamp is None else timestamp
+        entry['gain'] = raw_waveform.gain
+        entry['vertical_offset'] = raw_waveform.offset
+        entry['time_start'] = time_data.start
+        entry['time_interval'] = time_data.interval
+        entry['source_channel'] = source_channel
+        entry['adc_bit'] = adc_bit
+        self.data_file.flush()
+        self.index_file.write(self._entry.tobytes())
+        self.index_file.flush()
+
+        self.data_end += codes.size
+        self.n_records += 1
+
+    def record(self, scope, n_records, **kwargs):
+        """
+        Capture raw waveforms from an SDS814XHD and append them as they arrive.
+
+        :param scope: Connected SDS814XHD instance.
+        :param n_records: Number of waveforms to record.
+        :param kwargs: Further keyword arguments passed to scope.get_waveform().
+        :return: Number of waveforms recorded.
+        """
+        recorded = 0
+        try:
+            while recorded < n_records:
+                result = scope.get_waveform(raw=True, **kwargs)
+                if result is None:
+                    self.logger.error(f'Capture failed, recording stopped after {recorded} waveforms.')
+                    break
+                self.append(*result, source_channel=scope.source_channel, adc_bit=scope.adc_bit)
+                recorded += 1
+        except KeyboardInterrupt:
+            self.logger.warning(f'Recording interrupted after {recorded} waveforms.')
+        return recorded
+
+    def close(self):
+        """
+        Close the archive files.
+        """
+        for file in (self.data_file, self.index_file):
+            if not file.closed:
+                file.close()
+        self.logger.info(f'Archive {self.path} closed with {self.n_records} records.')
+
+
+class RawCaptureArchive:
+    """
+    Read-only random access to an archive written by RawCaptureWriter.
+
+    Both files are memory-mapped, so opening the archive and pulling a record or a
+    time window of a record only touches the pages that are actually read.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: Archive base path (without extension).
+        """
+        self.path = path
+        data_path, index_path = archive_paths(path)
+        n_records = os.path.getsize(index_path) // INDEX_DTYPE.itemsize
+        self.index = (np.memmap(index_path, dtype=INDEX_DTYPE, mode='r', shape=(n_records,))
+                      if n_records else np.zeros(0, dtype=INDEX_DTYPE))
+        n_samples = os.path.getsize(data_path) // DATA_DTYPE.itemsize
+        self.data = (np.memmap(data_path, dtype=DATA_DTYPE, mode='r', shape=(n_samples,))
+                     if n_samples else np.zeros(0, dtype=DATA_DTYPE))
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, k):
+        """
+        Get record k without reading any other record.
+
+        :param k: Record number.
+        :return: TimeAxis and RawWaveform whose codes are a memory-mapped view.
+        """
+        entry = self.index[k]
+        start = int(entry['offset'])
+        codes = self.data[start:start + int(entry['num_points'])]
+        time_data = TimeAxis(entry['time_start'], entry['time_interval'], entry['num_points'])
+        return time_data, RawWaveform(codes, entry['gain'], entry['vertical_offset'])
+
+    def window(self, k, t_start, t_stop):
+        """
+        Get the samples of record k with t_start <= t < t_stop.
+
+        :param k: Record number.
+        :param t_start: Start time in seconds.
+        :param t_stop: Stop time in seconds.
+        :return: TimeAxis and RawWaveform of the window.
+        """
+        time_data, raw_waveform = self[k]
+        window = time_data.slice_between(t_start, t_stop)
+        return time_data[window], raw_waveform[window]
+
+    def find_records(self, t_start, t_stop):
+        """
+        Find the records captured within a time range.
+
+        :param t_start: Start of the range in seconds since the epoch.
+        :param t_stop: End of the range in seconds since the epoch.
+        :return: Array of record numbers.
+        """
+        timestamps = self.index['timestamp']
+        return np.flatnonzero((timestamps >= t_start) & (timestamps < t_stop))
@@ -0,0 +1,75 @@
+"""
+Module: Asyncio Instrument Wrapper
+Description: This module provides an asyncio interface to the blocking instrument drivers
+             (SDS814XHD, GPP25045, HP34401A, HP3457A, U1252B). Every driver method becomes
+             awaitable and runs its VISA I/O on a worker thread dedicated to that instrument,
+             so I/O on different instruments overlaps while calls to one instrument stay
+             in order.
+
+Author: Mykhailo Vorobiov
+Email: mvorobiov@wm.edu
+Date Created: 2024-10-15
+"""
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+
+class AsyncInstrument:
+    """
+    Awaitable proxy of a blocking instrument driver.
+
+    Method calls are forwarded to the driver and executed on a single worker thread
+    owned by this proxy; plain attributes are returned as is.
+
+    Example:
+        psu = AsyncInstrument(GPP25045(rm, 'ASRL5::INSTR'))
+        dmm = AsyncInstrument(HP34401A(rm, 'ASRL9::INSTR'))
+        await psu.set_voltage(5.0)
+        current, voltage = await asyncio.gather(dmm.query('READ?'), psu.get_voltage_meas())
+    """
+
+    def __init__(self, driver, name=None):
+        """
+        :param driver: Instance of a blocking instrument driver.
+        :param name: Name of the worker thread. Defaults to the driver class name.
+        """
+        self.driver = driver
+        self.executor = ThreadPoolExecutor(max_workers=1,
+                                           thread_name_prefix=name or type(driver).__name__)
+
+    def __getattr__(self, name):
+        attribute = getattr(self.driver, name)
+        if not callable(attribute):
+            return attribute
+
+        @functools.wraps(attribute)
+        async def method(*args, **kwargs):
+            return await self.run(attribute, *args, **kwargs)
+        return method
+
+    async def run(self, function, *args, **kwargs):
+        """
+        Run a blocking callable on this instrument's worker thread.
+
+        :param function: Callable, typically a driver method.
+        :return: Result of the callable.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(function, *args, **kwargs))
+
+    async def close(self):
+        """
+        Close the driver connection and shut the worker thread down.
+        """
+        try:
+            await self.run(self.driver.close)
+        finally:
+            self.executor.shutdown(wait=False)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
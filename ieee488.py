@@ -0,0 +1,238 @@
+"""
+Module: IEEE 488.2 Binary Transfer Helpers
+Description: This module provides functions shared by the instrument drivers to read
+             definite-length arbitrary blocks ('#<n><length><data>') and fixed-size
+             binary payloads from a pyvisa resource directly into preallocated buffers,
+             and to wait for operation completion (*OPC?, serial poll, SRQ) with a
+             bounded timeout instead of fixed sleeps.
+
+Author: Mykhailo Vorobiov
+Email: mvorobiov@wm.edu
+Date Created: 2024-10-15
+"""
+
+import math
+import time
+from contextlib import contextmanager
+
+import numpy as np
+from pyvisa import constants, errors
+
+READ_CHUNK_BYTES = 1 << 20  # Size of a single low-level VISA read
+
+POLL_INTERVAL = 0.002      # First serial poll interval in seconds
+MAX_POLL_INTERVAL = 0.05   # Serial poll interval cap in seconds
+
+GPIB_BYTE_TIME = 2e-6      # Approximate GPIB transfer time per byte in seconds
+
+
+def transfer_time(resource, num_bytes):
+    """
+    Estimate the time needed to transfer a number of bytes from the instrument.
+
+    Serial resources are limited by the baud rate (10 bit times per byte with one
+    start and one stop bit); other interfaces are approximated by GPIB_BYTE_TIME.
+
+    :param resource: Open pyvisa resource, or None.
+    :param num_bytes: Number of bytes.
+    :return: Time in seconds.
+    """
+    baud_rate = getattr(resource, 'baud_rate', None)
+    if baud_rate:
+        return num_bytes * 10 / baud_rate
+    return num_bytes * GPIB_BYTE_TIME
+
+
+@contextmanager
+def timeout_set(resource, seconds):
+    """
+    Temporarily set the VISA timeout of a resource.
+
+    :param resource: Open pyvisa resource.
+    :param seconds: Timeout in seconds.
+    """
+    previous = resource.timeout
+    resource.timeout = max(int(math.ceil(seconds * 1000)), 1)
+    try:
+        yield resource
+    finally:
+        resource.timeout = previous
+
+
+def wait_for_opc(resource, timeout):
+    """
+    Block until the instrument has completed all pending operations.
+
+    The *OPC? reply is only sent once the operations are done, so this returns as
+    soon as they are; a VisaIOError is raised if that takes longer than the timeout.
+
+    :param resource: Open pyvisa message-based resource.
+    :param timeout: Upper bound of the waiting time in seconds.
+    :return: True if the instrument reported completion.
+    """
+    with timeout_set(resource, timeout):
+        return resource.query('*OPC?').strip().startswith('1')
+
+
+def wait_for_status(resource, mask, timeout, use_srq=False):
+    """
+    Wait until any bit of the mask is set in the instrument's status byte.
+
+    Polls the status byte with an interval growing from POLL_INTERVAL to
+    MAX_POLL_INTERVAL, or waits for a service request if use_srq is true (the
+    instrument must be configured to assert SRQ for the awaited condition).
+
+    :param resource: Open pyvisa GPIB resource.
+    :param mask: Status byte bit mask to wait for.
+    :param timeout: Upper bound of the waiting time in seconds.
+    :param use_srq: Wait for SRQ instead of polling.
+    :return: The status byte, or None if the condition was not met in time.
+    """
+    deadline = time.monotonic() + timeout
+    if use_srq:
+        try:
+            resource.wait_for_srq(max(int(math.ceil(timeout * 1000)), 1))
+        except errors.VisaIOError:
+            return None
+        status = resource.read_stb()
+        return status if status & mask else None
+
+    interval = POLL_INTERVAL
+    while True:
+        status = resource.read_stb()
+        if status & mask:
+            return status
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        time.sleep(min(interval, remaining))
+        interval = min(2 * interval, MAX_POLL_INTERVAL)
+
+
+def read_exact_into(resource, buffer, chunk_bytes=READ_CHUNK_BYTES):
+    """
+    Read exactly len(buffer) bytes from the resource into a caller-supplied buffer.
+
+    Data is copied into the buffer one low-level VISA read at a time, so no copy of
+    the whole payload is ever made.
+
+    :param resource: Open pyvisa message-based resource.
+    :param buffer: Writable buffer (bytearray, memoryview or numpy array).
+    :param chunk_bytes: Maximum size of a single low-level read.
+    :return: True if the instrument signalled the end of the message with the last byte.
+    """
+    view = memoryview(buffer).cast('B')
+    status = constants.StatusCode.success_max_count_read
+    position = 0
+    with resource.ignore_warning(constants.StatusCode.success_device_not_present,
+                                 constants.StatusCode.success_max_count_read):
+        while position < view.nbytes:
+            size = min(chunk_bytes, view.nbytes - position)
+            chunk, status = resource.visalib.read(resource.session, size)
+            view[position:position + len(chunk)] = chunk
+            position += len(chunk)
+    return status == constants.StatusCode.success
+
+
+def read_block_header(resource):
+    """
+    Read the '#<n><length>' header of a definite-length arbitrary block.
+
+    Any response header preceding the '#' (e.g. 'DAT2,') is skipped.
+
+    :param resource: Open pyvisa message-based resource.
+    :return: Number of payload bytes that follow the header.
+    """
+    for _ in range(64):
+        lead = resource.read_bytes(1)
+        if lead == b'#':
+            break
+    else:
+        raise ValueError('Block header not found in the response.')
+    num_digits = int(resource.read_bytes(1))
+    if num_digits == 0:
+        raise ValueError('Indefinite-length blocks are not supported.')
+    return int(resource.read_bytes(num_digits))
+
+
+def _discard_block(resource, num_bytes):
+    """
+    Read and drop a block payload and its terminator, so the next response starts in sync.
+
+    :param resource: Open pyvisa message-based resource, positioned after the header.
+    :param num_bytes: Block length from the header.
+    """
+    scratch = bytearray(min(num_bytes, READ_CHUNK_BYTES))
+    remaining = num_bytes
+    ended = False
+    while remaining > 0:
+        size = min(remaining, len(scratch))
+        ended = read_exact_into(resource, memoryview(scratch)[:size])
+        remaining -= size
+    if not ended:
+        resource.read_raw()
+
+
+def _check_block_length(resource, num_bytes, expected_bytes):
+    """
+    Verify the announced block length. On a mismatch the payload is dropped and a
+    ValueError is raised.
+
+    :param resource: Open pyvisa message-based resource, positioned after the header.
+    :param num_bytes: Block length from the header.
+    :param expected_bytes: Expected block length, or None to accept any length.
+    """
+    if expected_bytes is None or num_bytes == expected_bytes:
+        return
+    _discard_block(resource, num_bytes)
+    raise ValueError(f'Block of {num_bytes} bytes received, expected {expected_bytes}.')
+
+
+def read_block_into(resource, buffer, expected_bytes=None, truncate=False):
+    """
+    Read a definite-length block into a caller-supplied buffer.
+
+    :param resource: Open pyvisa message-based resource.
+    :param buffer: Writable buffer large enough to hold the payload.
+    :param expected_bytes: Optional expected block length; ValueError if it differs.
+    :param truncate: If true, a payload larger than the buffer fills it and the rest is
+                     dropped; otherwise it raises ValueError.
+    :return: Number of payload bytes written to the buffer.
+    """
+    num_bytes = read_block_header(resource)
+    _check_block_length(resource, num_bytes, expected_bytes)
+    view = memoryview(buffer).cast('B')
+    if num_bytes > view.nbytes and truncate:
+        read_exact_into(resource, view)
+        _discard_block(resource, num_bytes - view.nbytes)
+        return view.nbytes
+    if num_bytes > view.nbytes:
+        _discard_block(resource, num_bytes)
+        raise ValueError(f'Block of {num_bytes} bytes does not fit a {view.nbytes} byte buffer.')
+    ended = read_exact_into(resource, view[:num_bytes])
+    if not ended:
+        resource.read_raw()  # Consume the trailing terminator
+    return num_bytes
+
+
+def read_block(resource, dtype=np.uint8, out=None, expected_bytes=None, truncate=False):
+    """
+    Read a definite-length block and return it as a numpy array without copying.
+
+    :param resource: Open pyvisa message-based resource.
+    :param dtype: Numpy dtype of the block elements.
+    :param out: Optional preallocated array to read into. Allocated from the header if None.
+    :param expected_bytes: Optional expected block length; ValueError if it differs.
+    :param truncate: If true, elements that do not fit out are dropped instead of raising.
+    :return: Numpy array (a view of out if given) holding the block elements.
+    """
+    dtype = np.dtype(dtype)
+    if out is None:
+        num_bytes = read_block_header(resource)
+        _check_block_length(resource, num_bytes, expected_bytes)
+        out = np.empty(num_bytes // dtype.itemsize, dtype=dtype)
+        if not read_exact_into(resource, out):
+            resource.read_raw()
+        return out
+    num_bytes = read_block_into(resource, out, expected_bytes, truncate)
+    return out.reshape(-1)[:num_bytes // out.dtype.itemsize]
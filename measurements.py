@@ -0,0 +1,182 @@
+"""
+Module: Waveform Measurements
+Description: This module provides vectorized pulse and amplitude measurements (RMS, top/base,
+             rise/fall times, frequency, duty cycle, ...) computed with numpy across a whole
+             batch of oscilloscope records at once, e.g. the (n_frames, n_points) output of
+             SDS814XHD.get_sequence_frames().
+
+Author: Mykhailo Vorobiov
+Email: mvorobiov@wm.edu
+Date Created: 2024-10-15
+"""
+
+import numpy as np
+
+from waveform import RawWaveform, TimeAxis
+
+# Result schema: one record of this dtype per waveform. Times are in seconds,
+# levels in the units of the input (volts, or codes for plain code arrays).
+# Quantities that cannot be determined (e.g. no edges) are NaN.
+MEASUREMENT_DTYPE = np.dtype([('minimum', 'f8'),
+                              ('maximum', 'f8'),
+                              ('mean', 'f8'),
+                              ('rms', 'f8'),
+                              ('ac_rms', 'f8'),
+                              ('base', 'f8'),
+                              ('top', 'f8'),
+                              ('amplitude', 'f8'),
+                              ('rise_time', 'f8'),
+                              ('fall_time', 'f8'),
+                              ('period', 'f8'),
+                              ('frequency', 'f8'),
+                              ('duty_cycle', 'f8'),
+                              ('positive_width', 'f8'),
+                              ('negative_width', 'f8'),
+                              ('edge_count', 'i8')])
+
+
+def _crossings(values, levels, rising=True):
+    """
+    Find interpolated threshold crossings in every record.
+
+    :param values: (n_records, n_points) array.
+    :param levels: (n_records,) array of threshold levels.
+    :param rising: Find rising crossings if true, falling crossings otherwise.
+    :return: Arrays of record indices and fractional sample positions, sorted by record
+             and position.
+    """
+    above = values > levels[:, None]
+    if rising:
+        rows, cols = np.nonzero(~above[:, :-1] & above[:, 1:])
+    else:
+        rows, cols = np.nonzero(above[:, :-1] & ~above[:, 1:])
+    before = values[rows, cols]
+    after = values[rows, cols + 1]
+    fraction = (levels[rows] - before) / (after - before)
+    return rows, cols + fraction
+
+
+def _per_record_mean(rows, samples, n_records):
+    """
+    Average samples grouped by record index.
+
+    :return: (n_records,) array of means, NaN where a record has no samples.
+    """
+    counts = np.bincount(rows, minlength=n_records)
+    sums = np.bincount(rows, weights=samples, minlength=n_records)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts > 0, sums / counts, np.nan)
+
+
+def _transition_times(low_rows, low_positions, high_rows, high_positions, n_records, n_points):
+    """
+    Pair every end-threshold crossing with the latest start-threshold crossing before it.
+
+    :return: (n_records,) array of mean transition durations in samples.
+    """
+    if high_rows.size == 0 or low_rows.size == 0:
+        return np.full(n_records, np.nan)
+    span = n_points + 1
+    low_keys = low_rows * span + low_positions
+    high_keys = high_rows * span + high_positions
+    match = np.searchsorted(low_keys, high_keys) - 1
+    valid = match >= 0
+    match = np.where(valid, match, 0)
+    valid &= low_rows[match] == high_rows
+    # Each start crossing may only be used by the first end crossing after it
+    valid[1:] &= ~((match[1:] == match[:-1]) & valid[:-1])
+    durations = high_positions - low_positions[match]
+    return _per_record_mean(high_rows[valid], durations[valid], n_records)
+
+
+def measure(waveforms, time_data=None, low=0.1, high=0.9):
+    """
+    Compute pulse and amplitude measurements of a batch of evenly sampled records.
+
+    Top and base levels are the means of the samples above and below the midpoint
+    between minimum and maximum. Edges are detected as crossings of the levels
+    base + low/0.5/high * amplitude without hysteresis, so noisy records should be
+    filtered or decimated first.
+
+    :param waveforms: (n_records, n_points) or (n_points,) array, or a RawWaveform.
+    :param time_data: TimeAxis (or sample interval in seconds) of the records.
+                      Times are in samples if None.
+    :param low: Lower reference level for rise/fall times as a fraction of the amplitude.
+    :param high: Upper reference level for rise/fall times as a fraction of the amplitude.
+    :return: Structured array of MEASUREMENT_DTYPE with one entry per record.
+    """
+    if isinstance(waveforms, RawWaveform):
+        waveforms = waveforms.scale(waveforms.codes)
+    values = np.atleast_2d(np.asarray(waveforms))
+    if not np.issubdtype(values.dtype, np.floating):
+        values = values.astype(np.float32)
+    n_records, n_points = values.shape
+    if isinstance(time_data, TimeAxis):
+        interval = time_data.interval
+    else:
+        interval = 1.0 if time_data is None else float(time_data)
+
+    result = np.zeros(n_records, dtype=MEASUREMENT_DTYPE)
+    minimum = values.min(axis=1).astype(np.float64)
+    maximum = values.max(axis=1).astype(np.float64)
+    mean = values.mean(axis=1, dtype=np.float64)
+    mean_square = np.einsum('ij,ij->i', values, values, dtype=np.float64) / n_points
+    result['minimum'] = minimum
+    result['maximum'] = maximum
+    result['mean'] = mean
+    result['rms'] = np.sqrt(mean_square)
+    result['ac_rms'] = np.sqrt(np.maximum(mean_square - mean ** 2, 0.0))
+
+    middle = 0.5 * (minimum + maximum)
+    upper = values > middle[:, None]
+    upper_count = upper.sum(axis=1)
+    upper_sum = np.where(upper, values, 0).sum(axis=1, dtype=np.float64)
+    lower_sum = mean * n_points - upper_sum
+    with np.errstate(invalid='ignore', divide='ignore'):
+        top = np.where(upper_count > 0, upper_sum / upper_count, maximum)
+        base = np.where(upper_count < n_points, lower_sum / (n_points - upper_count), minimum)
+    amplitude = top - base
+    result['top'] = top
+    result['base'] = base
+    result['amplitude'] = amplitude
+
+    low_level = base + low * amplitude
+    mid_level = base + 0.5 * amplitude
+    high_level = base + high * amplitude
+
+    rise_low = _crossings(values, low_level, rising=True)
+    rise_high = _crossings(values, high_level, rising=True)
+    fall_high = _crossings(values, high_level, rising=False)
+    fall_low = _crossings(values, low_level, rising=False)
+    result['rise_time'] = interval * _transition_times(*rise_low, *rise_high, n_records, n_points)
+    result['fall_time'] = interval * _transition_times(*fall_high, *fall_low, n_records, n_points)
+
+    rows, positions = _crossings(values, mid_level, rising=True)
+    record_index = np.arange(n_records)
+    first = np.searchsorted(rows, record_index, side='left')
+    last = np.searchsorted(rows, record_index, side='right') - 1
+    edge_count = last - first + 1
+    result['edge_count'] = edge_count
+    periodic = edge_count >= 2
+    first = np.where(periodic, first, 0)
+    last = np.where(periodic, last, 0)
+    start = positions[first] if positions.size else np.zeros(n_records)
+    stop = positions[last] if positions.size else np.zeros(n_records)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        period = np.where(periodic, (stop - start) / (edge_count - 1), np.nan)
+
+        # Fraction of samples above the midpoint over the whole periods between the edges
+        high_cumulative = np.cumsum(values > mid_level[:, None], axis=1, dtype=np.int32)
+        start_index = np.ceil(start).astype(np.intp)
+        stop_index = np.ceil(stop).astype(np.intp)
+        high_samples = (high_cumulative[record_index, np.minimum(stop_index, n_points - 1)]
+                        - high_cumulative[record_index, np.minimum(start_index, n_points - 1)])
+        duty_cycle = np.where(periodic & (stop_index > start_index),
+                              high_samples / (stop_index - start_index), np.nan)
+
+    result['period'] = interval * period
+    result['frequency'] = 1.0 / (interval * period)
+    result['duty_cycle'] = duty_cycle
+    result['positive_width'] = interval * period * duty_cycle
+    result['negative_width'] = interval * period * (1.0 - duty_cycle)
+    return result
@@ -0,0 +1,192 @@
+"""
+Module: Streaming Waveform Recorder
+Description: This module provides a recorder that appends oscilloscope waveforms and their
+             preamble metadata to chunked, compressed HDF5 datasets as they arrive, so that
+             long runs never have to be held in memory. Requires the optional h5py package.
+
+Author: Mykhailo Vorobiov
+Email: mvorobiov@wm.edu
+Date Created: 2024-10-15
+"""
+
+import logging
+import time
+
+import numpy as np
+
+from waveform import RawWaveform
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+
+class HDF5WaveformRecorder:
+    """
+    Appends waveforms to an HDF5 file, one row of a (n_records, n_points) dataset per capture.
+
+    File layout:
+        /waveforms          (n_records, n_points) int16 codes or float32 volts
+        /timestamps         (n_records,) capture times in seconds since the epoch
+        /preamble/<field>   (n_records,) one column per get_preamble_dict() entry
+        /gain, /offset      (n_records,) code to volt scaling (raw code recordings only)
+
+    The number of complete records is stored in the 'n_records' attribute and is
+    updated only after a record has been fully written. Reopening an existing file
+    resumes the run after the last complete record.
+    """
+
+    # Waveform chunks hold a single record of at most this many points, so an append
+    # only compresses and writes its own data and never rewrites earlier records.
+    CHUNK_POINTS = 1 << 20
+
+    def __init__(self, path, compression='gzip', compression_opts=4, chunk_records=16,
+                 flush_every=16, log_level='INFO'):
+        """
+        :param path: Path of the HDF5 file. Opened for appending if it exists.
+        :param compression: h5py compression filter ('gzip', 'lzf' or None).
+        :param compression_opts: Compression level for gzip.
+        :param chunk_records: Number of records per HDF5 chunk of the per-record metadata
+                              (timestamps, scaling, preamble).
+        :param flush_every: Flush the file to disk every this many records.
+        :param log_level: Level of logging.
+        """
+        self.logger = logging.getLogger(__name__)
+        logging.basicConfig(level=log_level)
+        if h5py is None:
+            raise ImportError('HDF5WaveformRecorder requires the h5py package.')
+        self.path = path
+        self.compression = compression
+        self.compression_opts = compression_opts if compression == 'gzip' else None
+        self.chunk_records = chunk_records
+        self.flush_every = flush_every
+        self.file = h5py.File(path, 'a')
+        self.n_records = int(self.file.attrs.get('n_records', 0))
+        if 'waveforms' in self.file:
+            self._truncate(self.n_records)
+            self.logger.info(f'Resuming {path} after {self.n_records} records.')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self.n_records
+
+    def _truncate(self, n_records):
+        """
+        Drop partially written records beyond the last complete one.
+
+        :param n_records: Number of complete records to keep.
+        """
+        for dataset in self._datasets():
+            if dataset.shape[0] > n_records:
+                dataset.resize(n_records, axis=0)
+
+    def _datasets(self):
+        names = ['waveforms', 'timestamps', 'gain', 'offset']
+        datasets = [self.file[name] for name in names if name in self.file]
+        if 'preamble' in self.file:
+            datasets.extend(self.file['preamble'].values())
+        return datasets
+
+    def _create_dataset(self, name, shape, dtype, compress=False):
+        if shape:
+            chunks = (1,) * len(shape) + (min(shape[-1], self.CHUNK_POINTS),)
+        else:
+            chunks = (self.chunk_records,)
+        return self.file.create_dataset(
+            name, shape=(0,) + shape, maxshape=(None,) + shape, dtype=dtype,
+            chunks=chunks,
+            compression=self.compression if compress else None,
+            compression_opts=self.compression_opts if compress else None,
+            shuffle=bool(compress and self.compression))
+
+    @staticmethod
+    def _append_row(dataset, index, value):
+        if dataset.shape[0] <= index:
+            dataset.resize(index + 1, axis=0)
+        dataset[index] = value
+
+    def append(self, waveform, preamble=None, timestamp=None):
+        """
+        Append one waveform to the file.
+
+        :param waveform: Array of voltages or a RawWaveform of int16 codes.
+        :param preamble: Optional dictionary of metadata, e.g. SDS814XHD.get_preamble_dict().
+        :param timestamp: Capture time in seconds since the epoch. Defaults to time.time().
+        """
+        raw = isinstance(waveform, RawWaveform)
+        samples = waveform.codes if raw else np.asarray(waveform, dtype=np.float32)
+        if 'waveforms' not in self.file:
+            self._create_dataset('waveforms', samples.shape, samples.dtype, compress=True)
+            self._create_dataset('timestamps', (), np.float64)
+            if raw:
+                self._create_dataset('gain', (), np.float64)
+                self._create_dataset('offset', (), np.float64)
+        waveforms = self.file['waveforms']
+        if samples.shape != waveforms.shape[1:]:
+            raise ValueError(f'Waveform shape {samples.shape} does not match the recorded '
+                             f'shape {waveforms.shape[1:]}.')
+        if samples.dtype != waveforms.dtype or raw != ('gain' in self.file):
+            kind = 'raw codes' if raw else 'volts'
+            recorded = 'raw codes' if 'gain' in self.file else 'volts'
+            raise ValueError(f'Waveform of {kind} ({samples.dtype}) does not match the recorded '
+                             f'{recorded} ({waveforms.dtype}).')
+
+        index = self.n_records
+        self._append_row(waveforms, index, samples)
+        self._append_row(self.file['timestamps'], index, time.time() if timestamp is None else timestamp)
+        if raw:
+            self._append_row(self.file['gain'], index, waveform.gain)
+            self._append_row(self.file['offset'], index, waveform.offset)
+        if preamble:
+            group = self.file.require_group('preamble')
+            for key, value in preamble.items():
+                if key not in group:
+                    dtype = h5py.string_dtype() if isinstance(value, str) else np.asarray(value).dtype
+                    dataset = self._create_dataset(f'preamble/{key}', (), dtype)
+                    dataset.resize(index, axis=0)
+                self._append_row(group[key], index, value)
+
+        self.n_records = index + 1
+        self.file.attrs['n_records'] = self.n_records
+        if self.n_records % self.flush_every == 0:
+            self.file.flush()
+
+    def record(self, scope, n_records, raw=True, **kwargs):
+        """
+        Capture waveforms from an SDS814XHD and append them as they arrive.
+
+        :param scope: Connected SDS814XHD instance.
+        :param n_records: Number of waveforms to record.
+        :param raw: If true, record int16 codes with their scaling instead of volts.
+        :param kwargs: Further keyword arguments passed to scope.get_waveform().
+        :return: Number of waveforms recorded.
+        """
+        recorded = 0
+        try:
+            while recorded < n_records:
+                result = scope.get_waveform(raw=raw, **kwargs)
+                if result is None:
+                    self.logger.error(f'Capture failed, recording stopped after {recorded} waveforms.')
+                    break
+                self.append(result[1], scope.get_preamble_dict())
+                recorded += 1
+        except KeyboardInterrupt:
+            self.logger.warning(f'Recording interrupted after {recorded} waveforms.')
+        finally:
+            self.file.flush()
+        return recorded
+
+    def close(self):
+        """
+        Flush and close the file.
+        """
+        if self.file:
+            self.file.close()
+            self.file = None
+            self.logger.info(f'Recorder closed with {self.n_records} records in {self.path}.')
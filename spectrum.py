@@ -0,0 +1,184 @@
+"""
+Module: Waveform Spectra
+Description: This module provides a power spectral density stage for repeated oscilloscope
+             captures. Window functions and frequency axes are cached per record layout,
+             FFT output buffers are reused, and Welch averaging runs incrementally over a
+             stream of captures without storing the individual traces.
+
+Author: Mykhailo Vorobiov
+Email: mvorobiov@wm.edu
+Date Created: 2024-10-15
+"""
+
+from functools import lru_cache
+
+import numpy as np
+
+from waveform import RawWaveform, TimeAxis
+
+WINDOWS = {'hann': np.hanning,
+           'hamming': np.hamming,
+           'blackman': np.blackman,
+           'rectangular': np.ones
+           }
+
+
+@lru_cache(maxsize=32)
+def get_window(name, num_points):
+    """
+    Get a cached window function and its power normalisation.
+
+    :param name: Window name, one of WINDOWS.
+    :param num_points: Window length.
+    :return: Read-only float32 window array and the sum of its squared values.
+    """
+    if name not in WINDOWS:
+        raise ValueError(f"Invalid window '{name}'. Valid windows: {', '.join(WINDOWS)}.")
+    window = WINDOWS[name](num_points).astype(np.float32)
+    window.flags.writeable = False
+    return window, float(np.sum(window.astype(np.float64) ** 2))
+
+
+@lru_cache(maxsize=32)
+def get_frequencies(num_points, interval):
+    """
+    Get the cached one-sided frequency axis of a real FFT.
+
+    :param num_points: Segment length in samples.
+    :param interval: Sample interval in seconds.
+    :return: Read-only array of frequencies in Hz.
+    """
+    frequencies = np.fft.rfftfreq(num_points, interval)
+    frequencies.flags.writeable = False
+    return frequencies
+
+
+class WelchPSD:
+    """
+    Running Welch estimate of the one-sided power spectral density (units^2/Hz).
+
+    Every capture passed to update() is split into overlapping windowed segments
+    whose periodograms are added to a running sum; only that sum is kept.
+    """
+
+    def __init__(self, segment_points=None, overlap=0.5, window='hann', detrend=True):
+        """
+        :param segment_points: Segment length in samples. Defaults to the whole capture.
+        :param overlap: Fraction of overlap between consecutive segments.
+        :param window: Window name, one of WINDOWS.
+        :param detrend: If true, subtract the mean of every segment.
+        """
+        if not 0 <= overlap < 1:
+            raise ValueError(f'Overlap must be in [0, 1), got {overlap}.')
+        if window not in WINDOWS:
+            raise ValueError(f"Invalid window '{window}'. Valid windows: {', '.join(WINDOWS)}.")
+        self.requested_points = segment_points
+        self.overlap = overlap
+        self.window = window
+        self.detrend = detrend
+        self.reset()
+
+    def reset(self):
+        """
+        Discard the accumulated average.
+        """
+        self.interval = None
+        self.segment_points = None
+        self.num_segments = 0
+        self.num_captures = 0
+        self._power_sum = None
+        self._segments = None
+        self._spectrum = None
+
+    def _allocate(self, num_segments, segment_points):
+        """
+        (Re)allocate the reusable segment and FFT output buffers.
+        """
+        if self._segments is None or self._segments.shape[0] < num_segments:
+            self._segments = np.empty((num_segments, segment_points), dtype=np.float32)
+            self._spectrum = np.empty((num_segments, segment_points // 2 + 1), dtype=np.complex64)
+
+    def update(self, time_data, waveform):
+        """
+        Add a capture to the running average.
+
+        :param time_data: TimeAxis of the capture, or the sample interval in seconds.
+        :param waveform: 1-D array of samples or a RawWaveform.
+        """
+        interval = time_data.interval if isinstance(time_data, TimeAxis) else float(time_data)
+        gain = 1.0
+        if isinstance(waveform, RawWaveform):
+            if self.detrend:
+                # The offset only affects the removed mean, so stay in code space
+                gain = waveform.gain
+                waveform = waveform.codes
+            else:
+                waveform = waveform.to_volts()
+        values = np.asarray(waveform)
+
+        segment_points = self.requested_points or values.size
+        if self._power_sum is None:
+            self.interval = interval
+            self.segment_points = segment_points
+            self._power_sum = np.zeros(segment_points // 2 + 1, dtype=np.float64)
+        elif interval != self.interval or segment_points != self.segment_points:
+            raise ValueError('Capture layout changed; call reset() before changing the '
+                             'sample interval or segment length.')
+        if values.size < segment_points:
+            raise ValueError(f'Capture of {values.size} points is shorter than a segment '
+                             f'of {segment_points} points.')
+
+        step = max(int(round(segment_points * (1 - self.overlap))), 1)
+        views = np.lib.stride_tricks.sliding_window_view(values, segment_points)[::step]
+        num_segments = views.shape[0]
+        self._allocate(num_segments, segment_points)
+        segments = self._segments[:num_segments]
+        spectrum = self._spectrum[:num_segments]
+
+        segments[...] = views
+        if self.detrend:
+            segments -= segments.mean(axis=1, keepdims=True)
+        segments *= get_window(self.window, segment_points)[0]
+        np.fft.rfft(segments, axis=1, out=spectrum)
+        power = np.abs(spectrum) ** 2
+        self._power_sum += power.sum(axis=0, dtype=np.float64) * gain ** 2
+        self.num_segments += num_segments
+        self.num_captures += 1
+
+    def frequencies(self):
+        """
+        :return: One-sided frequency axis in Hz of the current estimate.
+        """
+        return get_frequencies(self.segment_points, self.interval)
+
+    def psd(self):
+        """
+        Get the current averaged power spectral density.
+
+        :return: Frequencies in Hz and the one-sided PSD in units^2/Hz, or None before
+                 the first update.
+        """
+        if not self.num_segments:
+            return None
+        window_power = get_window(self.window, self.segment_points)[1]
+        density = self._power_sum * (self.interval / (window_power * self.num_segments))
+        density[1:] *= 2
+        if self.segment_points % 2 == 0:
+            density[-1] /= 2  # The Nyquist bin has no negative-frequency twin
+        return self.frequencies(), density
+
+
+def psd(time_data, waveform, segment_points=None, overlap=0.5, window='hann'):
+    """
+    Welch power spectral density of a single capture.
+
+    :param time_data: TimeAxis of the capture, or the sample interval in seconds.
+    :param waveform: 1-D array of samples or a RawWaveform.
+    :param segment_points: Segment length in samples. Defaults to the whole capture.
+    :param overlap: Fraction of overlap between consecutive segments.
+    :param window: Window name, one of WINDOWS.
+    :return: Frequencies in Hz and the one-sided PSD in units^2/Hz.
+    """
+    estimator = WelchPSD(segment_points, overlap, window)
+    estimator.update(time_data, waveform)
+    return estimator.psd()
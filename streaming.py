@@ -0,0 +1,282 @@
+"""
+Module: Streaming Waveform Acquisition
+Description: This module provides a background acquisition thread for the SDS814XHD
+             oscilloscope that writes captures into a preallocated ring buffer of
+             waveform slots, so that analysis code does not throttle the capture rate.
+
+Author: Mykhailo Vorobiov
+Email: mvorobiov@wm.edu
+Date Created: 2024-10-15
+"""
+
+import logging
+import threading
+import time
+
+import numpy as np
+
+from waveform import RawWaveform
+
+
+class WaveformRingBuffer:
+    """
+    A fixed-size ring of preallocated waveform slots for one producer and one consumer.
+
+    The producer and the consumer each own one monotonically increasing index, so
+    no lock is needed on the data path. Every slot carries the sequence number of
+    the capture it holds; a consumer holding a view can call is_valid() to detect
+    that the slot was overwritten under the 'overwrite' policy.
+    """
+
+    def __init__(self, n_slots, num_points, dtype=np.int16):
+        """
+        :param n_slots: Number of waveform slots.
+        :param num_points: Capacity of a slot in samples.
+        :param dtype: Sample dtype of the slots.
+        """
+        self.n_slots = int(n_slots)
+        self.data = np.empty((self.n_slots, num_points), dtype=dtype)
+        self.lengths = np.zeros(self.n_slots, dtype=np.int64)
+        self.timestamps = np.zeros(self.n_slots, dtype=np.float64)
+        self.sequence = np.full(self.n_slots, -1, dtype=np.int64)
+        self.metadata = [None] * self.n_slots
+        self._write_index = 0  # Written by the producer only
+        self._read_index = 0   # Written by the consumer only
+        self.dropped = 0       # Captures discarded by the producer (producer only)
+        self.overruns = 0      # Captures overwritten before being read (consumer only)
+
+    def __len__(self):
+        """Number of captures waiting to be read."""
+        return min(self._write_index - self._read_index, self.n_slots)
+
+    def is_full(self):
+        return self._write_index - self._read_index >= self.n_slots
+
+    def reserve(self):
+        """
+        Reserve the next slot for writing (producer side).
+
+        :return: Index of the slot to write into.
+        """
+        slot = self._write_index % self.n_slots
+        self.sequence[slot] = -1  # Invalidate the slot while it is being written
+        return slot
+
+    def commit(self, slot, length, metadata=None, timestamp=None):
+        """
+        Publish a written slot to the consumer (producer side).
+
+        :param slot: Slot index returned by reserve().
+        :param length: Number of valid samples in the slot.
+        :param metadata: Arbitrary per-capture metadata.
+        :param timestamp: Capture time in seconds. Defaults to time.time().
+        """
+        self.lengths[slot] = length
+        self.timestamps[slot] = time.time() if timestamp is None else timestamp
+        self.metadata[slot] = metadata
+        self.sequence[slot] = self._write_index
+        self._write_index += 1
+
+    def get(self):
+        """
+        Take a zero-copy view of the oldest unread capture (consumer side).
+
+        :return: Tuple (sequence number, samples view, timestamp, metadata) or None if empty.
+        """
+        while True:
+            read_index = self._read_index
+            write_index = self._write_index
+            if read_index >= write_index:
+                return None
+            if write_index - read_index > self.n_slots:
+                # The producer lapped the consumer; skip to the oldest capture still held
+                self.overruns += write_index - read_index - self.n_slots
+                read_index = write_index - self.n_slots
+                self._read_index = read_index
+            slot = read_index % self.n_slots
+            metadata = self.metadata[slot]
+            timestamp = self.timestamps[slot]
+            view = self.data[slot, :self.lengths[slot]]
+            if self.sequence[slot] == read_index:
+                return read_index, view, timestamp, metadata
+            self._read_index = read_index + 1
+            self.overruns += 1
+
+    def release(self, sequence_number):
+        """
+        Hand the slot of a consumed capture back to the producer (consumer side).
+
+        :param sequence_number: Sequence number returned by get().
+        """
+        if sequence_number >= self._read_index:
+            self._read_index = sequence_number + 1
+
+    def is_valid(self, sequence_number):
+        """
+        Check that the slot of a capture has not been overwritten since get().
+
+        :param sequence_number: Sequence number returned by get().
+        :return: True if the view still holds that capture.
+        """
+        return self.sequence[sequence_number % self.n_slots] == sequence_number
+
+
+class StreamingAcquisition:
+    """
+    Runs the trigger/fetch loop of an SDS814XHD in a worker thread.
+
+    Captures are transferred as raw codes directly into the slots of a
+    WaveformRingBuffer. While the acquisition runs, the worker thread owns the
+    oscilloscope connection; other threads must not talk to the instrument.
+
+    Back-pressure policies when the ring is full:
+        'block'     - wait until the consumer releases a slot (scope is throttled),
+        'drop'      - discard the new capture without transferring it,
+        'overwrite' - reuse the oldest slot (consumer overruns are counted).
+    """
+
+    POLICIES = ['block', 'drop', 'overwrite']
+
+    def __init__(self, scope, n_slots=16, policy='block', arm=True, trigger_timeout=10.0,
+                 chunk_points=None, poll_interval=1e-3):
+        """
+        :param scope: Connected SDS814XHD instance.
+        :param n_slots: Number of waveform slots in the ring buffer.
+        :param policy: Back-pressure policy, one of POLICIES.
+        :param arm: If true, arm a single acquisition for every capture; otherwise fetch
+                    the free-running display record.
+        :param trigger_timeout: Maximum time to wait for a trigger in seconds.
+        :param chunk_points: Transfer window size, see SDS814XHD.get_waveform.
+        :param poll_interval: Sleep time in seconds while waiting on a full or empty ring.
+        """
+        self.logger = logging.getLogger(__name__)
+        if policy not in self.POLICIES:
+            raise ValueError(f"Invalid policy '{policy}'. Valid policies: {', '.join(self.POLICIES)}.")
+        self.scope = scope
+        self.n_slots = n_slots
+        self.policy = policy
+        self.arm = arm
+        self.trigger_timeout = trigger_timeout
+        self.chunk_points = chunk_points
+        self.poll_interval = poll_interval
+        self.ring = None
+        self.errors = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Read the preamble, allocate the ring buffer and start the worker thread.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            self.logger.warning('Streaming acquisition is already running.')
+            return
+        self.scope.update_preamble()
+        self.ring = WaveformRingBuffer(self.n_slots, self.scope.num_points)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='SDS814XHD-stream', daemon=True)
+        self._thread.start()
+        self.logger.info(f'Streaming acquisition started ({self.n_slots} slots, '
+                         f'{self.scope.num_points} points, policy {self.policy}).')
+
+    def stop(self, timeout=None):
+        """
+        Stop the worker thread and wait for it to finish.
+
+        :param timeout: Maximum time to wait for the thread in seconds.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.logger.info(f'Streaming acquisition stopped. Captures: {self.captured}, '
+                         f'dropped: {self.dropped}, overruns: {self.overruns}.')
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def captured(self):
+        return self.ring._write_index if self.ring else 0
+
+    @property
+    def dropped(self):
+        return self.ring.dropped if self.ring else 0
+
+    @property
+    def overruns(self):
+        return self.ring.overruns if self.ring else 0
+
+    def _wait_for_slot(self):
+        """
+        Apply the back-pressure policy before a capture.
+
+        :return: True if a slot is available for the next capture.
+        """
+        if self.policy == 'overwrite' or not self.ring.is_full():
+            return True
+        if self.policy == 'drop':
+            return False
+        while self.ring.is_full():
+            if self._stop.is_set():
+                return False
+            time.sleep(self.poll_interval)
+        return True
+
+    def _run(self):
+        try:
+            self._capture_loop()
+        except Exception as e:
+            # e.g. pyvisa.errors.InvalidSession after the pooled session was closed
+            self.errors += 1
+            self.logger.exception(f'Streaming acquisition thread stopped by an error: {e}')
+
+    def _capture_loop(self):
+        while not self._stop.is_set():
+            if self.arm and not self.scope.wait_for_trigger(self.trigger_timeout):
+                continue
+            if not self._wait_for_slot():
+                if not self._stop.is_set():
+                    self.ring.dropped += 1
+                continue
+            slot = self.ring.reserve()
+            result = self.scope.get_waveform(chunk_points=self.chunk_points, raw=True,
+                                             out=self.ring.data[slot])
+            if result is None:
+                self.errors += 1
+                time.sleep(self.poll_interval)
+                continue
+            time_data, raw_waveform = result
+            self.ring.commit(slot, raw_waveform.codes.size,
+                             (time_data, raw_waveform.gain, raw_waveform.offset))
+
+    def get(self, timeout=None):
+        """
+        Take the oldest unread capture as a zero-copy view of its ring slot.
+
+        The slot stays reserved until release() is called with the returned sequence number.
+
+        :param timeout: Maximum time to wait for a capture in seconds. None waits until a
+                        capture arrives or the worker thread ends.
+        :return: Tuple (sequence number, TimeAxis, RawWaveform, timestamp), or None on
+                 timeout or once the worker thread has ended and the ring is empty.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            running = self.is_running()
+            item = self.ring.get() if self.ring else None
+            if item is not None:
+                sequence_number, codes, timestamp, (time_data, gain, offset) = item
+                return sequence_number, time_data, RawWaveform(codes, gain, offset), timestamp
+            if not running:
+                return None  # Stopped, or the worker thread died; nothing more will arrive
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(self.poll_interval)
+
+    def release(self, sequence_number):
+        """
+        Return a consumed capture's slot to the acquisition thread.
+
+        :param sequence_number: Sequence number returned by get().
+        """
+        self.ring.release(sequence_number)
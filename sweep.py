@@ -0,0 +1,297 @@
+"""
+Module: Sweep Engine
+Description: This module provides a reusable sweep engine for multi-instrument measurements:
+             it steps one or more setpoints (e.g. GPP25045.set_voltage), waits only as long
+             as the configured settling and integration times require, triggers all readouts
+             in parallel and streams the results into preallocated arrays.
+
+Author: Mykhailo Vorobiov
+Email: mvorobiov@wm.edu
+Date Created: 2024-10-15
+"""
+
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+class Readout:
+    """
+    A quantity read at every sweep point.
+
+    The settle time before the reading is a number of integration periods
+    (nplc / line_frequency of instruments that track them, see HP34401A and HP3457A)
+    plus a fixed time. The reading itself integrates again, so command and transfer
+    times are not part of the wait.
+    """
+
+    def __init__(self, name, read, instrument=None, settle_integrations=0, settle=0.0):
+        """
+        :param name: Name of the quantity (result field name).
+        :param read: Callable without arguments returning the reading as a float.
+        :param instrument: Driver the reading comes from. Readouts of the same instrument
+                           are executed one after another, different instruments in parallel.
+        :param settle_integrations: Number of integration periods to wait before reading.
+        :param settle: Additional settling time in seconds.
+        """
+        self.name = name
+        self.read = read
+        self.instrument = instrument if instrument is not None else getattr(read, '__self__', None)
+        self.settle_integrations = settle_integrations
+        self.settle = settle
+
+    def settle_time(self):
+        """
+        :return: Time in seconds to wait after a setpoint change before reading.
+        """
+        nplc = getattr(self.instrument, 'nplc', None)
+        line_frequency = getattr(self.instrument, 'line_frequency', None)
+        if nplc is None or not line_frequency or not self.settle_integrations:
+            return self.settle
+        return self.settle + self.settle_integrations * nplc / line_frequency
+
+
+class Setpoint:
+    """
+    A quantity stepped through a sequence of values.
+    """
+
+    def __init__(self, name, apply, values, settle=0.0):
+        """
+        :param name: Name of the quantity (result field name).
+        :param apply: Callable setting one value, e.g. GPP25045.set_voltage.
+        :param values: Iterable of values (materialised once at the start of the sweep).
+        :param settle: Settling time of the source in seconds after a change.
+        """
+        self.name = name
+        self.apply = apply
+        self.values = np.asarray(list(values), dtype=np.float64)
+        self.settle = settle
+
+
+class ReadoutGroup:
+    """
+    Triggers a set of readouts in parallel, one worker thread per instrument.
+    """
+
+    def __init__(self, readouts):
+        """
+        :param readouts: List of Readout instances.
+        """
+        self.readouts = readouts
+        # One worker per instrument keeps each VISA session on a single thread
+        self._groups = {}
+        for readout in readouts:
+            key = id(readout.instrument) if readout.instrument is not None else id(readout)
+            self._groups.setdefault(key, []).append(readout)
+        self._executor = None
+
+    def __enter__(self):
+        self._executor = ThreadPoolExecutor(max_workers=max(len(self._groups), 1))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._executor.shutdown()
+        self._executor = None
+
+    @staticmethod
+    def _read_group(readouts):
+        return [(readout.name, readout.read()) for readout in readouts]
+
+    def settle_time(self):
+        """
+        :return: Longest settle time required by the readouts in seconds.
+        """
+        return max((readout.settle_time() for readout in self.readouts), default=0.0)
+
+    def read(self, row):
+        """
+        Take all readings and store them in a result row.
+
+        :param row: Structured array element with one field per readout and 'timestamp'.
+        """
+        row['timestamp'] = time.time()
+        futures = [self._executor.submit(self._read_group, group) for group in self._groups.values()]
+        for future in futures:
+            for name, reading in future.result():
+                row[name] = np.nan if reading is None else reading
+
+
+class SweepEngine:
+    """
+    Runs setpoints and readouts over a sweep and collects the results.
+
+    All setpoints are stepped together (zip); build grids with np.meshgrid or
+    itertools.product before passing them. Results are written into a structured
+    array with one field per setpoint, one per readout and a 'timestamp' field.
+    """
+
+    def __init__(self, setpoints, readouts, callback=None, log_level='INFO'):
+        """
+        :param setpoints: List of Setpoint instances of equal length.
+        :param readouts: List of Readout instances.
+        :param callback: Optional callable(index, row) invoked after every point, e.g. to
+                         append the row to a data store.
+        :param log_level: Level of logging.
+        """
+        self.logger = logging.getLogger(__name__)
+        logging.basicConfig(level=log_level)
+        lengths = {len(setpoint.values) for setpoint in setpoints}
+        if len(lengths) != 1:
+            raise ValueError(f'All setpoints must have the same number of values, got {lengths}.')
+        self.setpoints = setpoints
+        self.readouts = readouts
+        self.callback = callback
+        self.num_points = lengths.pop()
+        names = ([setpoint.name for setpoint in setpoints]
+                 + [readout.name for readout in readouts] + ['timestamp'])
+        self.dtype = np.dtype([(name, np.float64) for name in names])
+        self.results = np.full(self.num_points, np.nan, dtype=self.dtype)
+
+    def run(self):
+        """
+        Execute the sweep.
+
+        :return: Structured array of results. Points not reached (e.g. after an
+                 interruption) are NaN.
+        """
+        previous = [None] * len(self.setpoints)
+        with ReadoutGroup(self.readouts) as readouts:
+            try:
+                for index in range(self.num_points):
+                    row = self.results[index]
+                    changed = []
+                    for k, setpoint in enumerate(self.setpoints):
+                        value = setpoint.values[index]
+                        if value != previous[k]:
+                            setpoint.apply(value)
+                            previous[k] = value
+                            changed.append(setpoint)
+                        row[setpoint.name] = value
+
+                    if changed:
+                        time.sleep(max(max(setpoint.settle for setpoint in changed),
+                                       readouts.settle_time()))
+                    readouts.read(row)
+                    if self.callback is not None:
+                        self.callback(index, row)
+            except KeyboardInterrupt:
+                self.logger.warning(f'Sweep interrupted at point {index} of {self.num_points}.')
+        return self.results
+
+
+class AdaptiveSweep:
+    """
+    Sweeps one setpoint with automatic refinement where the measured curve bends or
+    changes steeply (e.g. the knee of an I-V curve).
+
+    Starting from a coarse uniform grid, the interval with the largest loss is
+    bisected until every interval's loss is below the tolerance or the point budget
+    is used up. The loss of an interval is computed in coordinates normalised to the
+    swept range and to the range of the target readout:
+
+        loss = sqrt(triangle area of the neighbouring points)
+               + 0.02 * segment length + 0.02 * interval width
+
+    so curvature dominates, while long steep segments and wide gaps are also split.
+    """
+
+    def __init__(self, setpoint_name, apply, start, stop, readouts, target=None,
+                 initial_points=9, tolerance=0.02, max_points=60, min_step=0.0,
+                 settle=0.0, log_level='INFO'):
+        """
+        :param setpoint_name: Name of the swept quantity (result field name).
+        :param apply: Callable setting one value, e.g. GPP25045.set_voltage.
+        :param start: First setpoint value.
+        :param stop: Last setpoint value.
+        :param readouts: List of Readout instances.
+        :param target: Name of the readout that drives the refinement. Defaults to the first.
+        :param initial_points: Number of points of the initial uniform grid.
+        :param tolerance: Stop when the largest interval loss falls below this value.
+        :param max_points: Maximum number of measured points.
+        :param min_step: Intervals narrower than this (in setpoint units) are not split.
+        :param settle: Settling time of the source in seconds after a change.
+        :param log_level: Level of logging.
+        """
+        self.logger = logging.getLogger(__name__)
+        logging.basicConfig(level=log_level)
+        self.setpoint_name = setpoint_name
+        self.apply = apply
+        self.start = float(start)
+        self.stop = float(stop)
+        self.readouts = readouts
+        self.target = target or readouts[0].name
+        self.initial_points = max(int(initial_points), 3)
+        self.tolerance = tolerance
+        self.max_points = max(int(max_points), self.initial_points)
+        self.min_step = min_step
+        self.settle = settle
+        names = [setpoint_name] + [readout.name for readout in readouts] + ['timestamp']
+        self.dtype = np.dtype([(name, np.float64) for name in names])
+
+    @staticmethod
+    def interval_loss(x, y):
+        """
+        Compute the refinement loss of every interval of a sorted curve.
+
+        :param x: Sorted setpoint values.
+        :param y: Target readings at x.
+        :return: Array of len(x) - 1 interval losses.
+        """
+        x_range = (x[-1] - x[0]) or 1.0
+        finite = np.isfinite(y)
+        y_range = (np.ptp(y[finite]) if finite.any() else 0.0) or 1.0
+        xn = (x - x[0]) / x_range
+        yn = np.where(finite, (y - np.nanmin(y)) / y_range, 0.0) if finite.any() else np.zeros_like(x)
+        dx = np.diff(xn)
+        dy = np.diff(yn)
+        # Triangle areas of consecutive point triples, attached to both of their intervals
+        area = 0.5 * np.abs(dx[:-1] * dy[1:] - dx[1:] * dy[:-1])
+        triangle = np.zeros(dx.size)
+        triangle[:-1] += area
+        triangle[1:] += area
+        count = np.full(dx.size, 2.0)
+        count[[0, -1]] = 1.0
+        return np.sqrt(triangle / count) + 0.02 * np.hypot(dx, dy) + 0.02 * dx
+
+    def run(self):
+        """
+        Execute the adaptive sweep.
+
+        :return: Structured array of results sorted by setpoint value.
+        """
+        rows = []
+        previous = None
+        with ReadoutGroup(self.readouts) as readouts:
+
+            def measure(value):
+                nonlocal previous
+                row = np.full((), np.nan, dtype=self.dtype)
+                row[self.setpoint_name] = value
+                if value != previous:
+                    self.apply(value)
+                    previous = value
+                    time.sleep(max(self.settle, readouts.settle_time()))
+                readouts.read(row)
+                rows.append(row)
+
+            try:
+                for value in np.linspace(self.start, self.stop, self.initial_points):
+                    measure(value)
+                while len(rows) < self.max_points:
+                    results = np.sort(np.array(rows), order=self.setpoint_name)
+                    x = results[self.setpoint_name]
+                    loss = self.interval_loss(x, results[self.target])
+                    loss[np.diff(x) <= 2 * self.min_step] = 0.0
+                    worst = int(np.argmax(loss))
+                    if loss[worst] < self.tolerance:
+                        self.logger.info(f'Tolerance met after {len(rows)} points.')
+                        break
+                    measure(0.5 * (x[worst] + x[worst + 1]))
+                else:
+                    self.logger.info(f'Point budget of {self.max_points} exhausted.')
+            except KeyboardInterrupt:
+                self.logger.warning(f'Adaptive sweep interrupted after {len(rows)} points.')
+        return np.sort(np.array(rows, dtype=self.dtype), order=self.setpoint_name)
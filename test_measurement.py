@@ -7,44 +7,36 @@ import matplotlib.pyplot as plt
 from HP34401A import *
 from GPP25045 import *
 from U1252B import *
+from sweep import Setpoint, Readout, SweepEngine, AdaptiveSweep
+from visa_session import get_session_manager
 
 
-import pyvisa
-import time
-
-
-rm = pyvisa.ResourceManager()
+rm = get_session_manager()
 
 dmm_grid_hp = HP34401A(rm, 'visa://192.168.194.15/ASRL9::INSTR', alias='GridAmp', log_level='INFO')
 psu = GPP25045(rm, 'visa://192.168.194.15/ASRL5::INSTR', alias='PSU1', log_level='INFO')
 
-time.sleep(0.5)
 dmm_grid_hp.write('SYST:REM')
-time.sleep(0.5)
-dmm_grid_hp.write('FUNC:CURR:DC 0.00001,0.00000001')
-time.sleep(0.5)
+dmm_grid_hp.set_function('CURR:DC', 0.00001, 0.00000001)
+dmm_grid_hp.wait_for_completion()
 
 NPLCycles = 100
-dmm_grid_hp.write(f'CURR:DC:NPLC {NPLCycles}')
-
-anode_current = []
-grid_current = []
+dmm_grid_hp.set_nplc(NPLCycles)
 
 
 psu.toggle_output(True)
 
-voltage = np.round( np.linspace(0, 1, 40)**2 * 30, decimals=2)
-try:
-    for v in voltage:
-        psu.set_voltage(v)
-
-        time.sleep((NPLCycles+1)/60)
-
-        grid_current_reading = float(dmm_grid_hp.query('READ?').strip())
-        grid_current.append(grid_current_reading)
-
-except KeyboardInterrupt:
-    print("Script interrupted by user.")
+ADAPTIVE = False
+readouts = [Readout('Grid Current (A)', dmm_grid_hp.read, settle_integrations=1)]
+if ADAPTIVE:
+    engine = AdaptiveSweep('Grid Voltage (V)', psu.set_voltage, 0, 30, readouts,
+                           initial_points=9, tolerance=0.02, max_points=40, min_step=0.01)
+else:
+    voltage = np.round( np.linspace(0, 1, 40)**2 * 30, decimals=2)
+    engine = SweepEngine([Setpoint('Grid Voltage (V)', psu.set_voltage, voltage)], readouts)
+results = engine.run()
+voltage = results['Grid Voltage (V)']
+grid_current = results['Grid Current (A)']
 
 psu.toggle_output(False)
 dmm_grid_hp.close()
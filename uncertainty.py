@@ -0,0 +1,141 @@
+"""
+Module: Reading Uncertainty
+Description: This module provides a vectorized uncertainty calculator for HP 3457A readings.
+             The accuracy and resolution tables of the driver (DCV_ACC, DCV_RES, DCI_ACC,
+             DCI_RES) are converted once at import into numpy arrays indexed by range,
+             integration time and resolution, so error bars of millions of logged readings
+             are computed in a single call without per-reading dictionary lookups.
+
+Author: Mykhailo Vorobiov
+Email: mvorobiov@wm.edu
+Date Created: 2024-10-15
+"""
+
+import numpy as np
+
+from HP3457A import HP3457A
+
+# Unit prefixes used in the table range keys, e.g. '300mv', '3ma', '1a'
+PREFIXES = {'u': 1e-6, 'm': 1e-3, '': 1.0}
+
+# Native resolution (digits) of each integration time; the spec counts refer to its last digit
+NPLC_DIGITS = {100: 6.5, 10: 6.5, 1: 6.5, 0.1: 5.5, 0.005: 4.5, 0.0005: 3.5}
+
+
+def _parse_range(key, unit):
+    """
+    Convert a table range key such as '300mv' to its full scale value.
+
+    :param key: Range key of the table.
+    :param unit: Unit suffix of the keys ('v' or 'a').
+    :return: Range in volts or amps.
+    """
+    number = key[:-len(unit)]
+    prefix = number[-1] if number[-1] in PREFIXES else ''
+    return float(number[:len(number) - len(prefix)]) * PREFIXES[prefix]
+
+
+class AccuracyTable:
+    """
+    Accuracy specification of one function as numpy arrays.
+
+    Axes are sorted ascending: ranges (full scale values), nplc and digits.
+    percent and counts have shape (n_ranges, n_nplc), count_size (n_ranges, n_digits).
+    """
+
+    def __init__(self, acc_table, res_table, unit):
+        """
+        :param acc_table: Nested dict {range: {nplc: {'acc': percent, 'counts': counts}}}.
+        :param res_table: Nested dict {range: {digits: resolution}}.
+        :param unit: Unit suffix of the range keys ('v' or 'a').
+        """
+        range_keys = sorted(acc_table, key=lambda key: _parse_range(key, unit))
+        nplc_keys = sorted(next(iter(acc_table.values())), key=float)
+        digit_keys = sorted(next(iter(res_table.values())), key=float)
+
+        self.ranges = np.array([_parse_range(key, unit) for key in range_keys])
+        self.nplc = np.array([float(key) for key in nplc_keys])
+        self.digits = np.array([float(key) for key in digit_keys])
+        self.percent = np.array([[acc_table[r][n]['acc'] for n in nplc_keys] for r in range_keys])
+        self.counts = np.array([[acc_table[r][n]['counts'] for n in nplc_keys] for r in range_keys],
+                               dtype=np.float64)
+        self.count_size = np.array([[res_table[r][d] for d in digit_keys] for r in range_keys])
+        self.native_digits = np.array([NPLC_DIGITS[n] for n in self.nplc])
+        for array in (self.ranges, self.nplc, self.digits, self.percent, self.counts,
+                      self.count_size, self.native_digits):
+            array.flags.writeable = False
+
+
+TABLES = {'DCV': AccuracyTable(HP3457A.DCV_ACC, HP3457A.DCV_RES, 'v'),
+          'DCI': AccuracyTable(HP3457A.DCI_ACC, HP3457A.DCI_RES, 'a')
+          }
+
+
+def _lookup(axis, values, tolerance=1e-9):
+    """
+    Find the index of each value on a sorted axis.
+
+    :param axis: Sorted 1-D array.
+    :param values: Array of values expected on the axis.
+    :return: Index array and a mask of the values found on the axis.
+    """
+    index = np.clip(np.searchsorted(axis, values * (1 - tolerance)), 0, axis.size - 1)
+    found = np.abs(axis[index] - values) <= tolerance * np.abs(axis[index])
+    return index, found
+
+
+def uncertainty(readings, ranges, nplc, resolution=None, function='DCV'):
+    """
+    Compute the specified uncertainty +-(percent of reading + counts) of readings.
+
+    All arguments are broadcast against each other, so a scalar range or NPLC applies
+    to every reading. Ranges are full scale values (e.g. 3 for the 3 V range); readings
+    taken on autorange can pass the smallest range holding each reading. NPLC values
+    below the smallest tabulated one, ranges above the largest one and resolutions not
+    in the table give NaN.
+
+    :param readings: Array of readings in volts or amps.
+    :param ranges: Array of range full scale values, or None to use the smallest range
+                   holding each reading.
+    :param nplc: Array of integration times in power line cycles. Values between the
+                 tabulated ones use the next lower (less accurate) entry.
+    :param resolution: Array of display resolutions in digits (3.5 ... 6.5). The spec counts
+                       always refer to the native resolution of the NPLC; a coarser
+                       resolution adds half a count of its own (rounding of the reading).
+                       Defaults to the native resolution.
+    :param function: 'DCV' or 'DCI'.
+    :return: Array of absolute uncertainties in the units of the readings.
+    """
+    if function not in TABLES:
+        raise ValueError(f"Invalid function '{function}'. Valid functions: {', '.join(TABLES)}.")
+    table = TABLES[function]
+
+    readings = np.asarray(readings, dtype=np.float64)
+    magnitude = np.abs(readings)
+    ranges = magnitude if ranges is None else np.asarray(ranges, dtype=np.float64)
+    nplc = np.asarray(nplc, dtype=np.float64)
+    magnitude, ranges, nplc = np.broadcast_arrays(magnitude, ranges, nplc)
+
+    # Smallest range with a full scale of at least the given value
+    range_index = np.searchsorted(table.ranges, ranges * (1 - 1e-9))
+    valid = range_index < table.ranges.size
+    range_index = np.minimum(range_index, table.ranges.size - 1)
+
+    # Largest tabulated integration time not exceeding the given one
+    nplc_index = np.searchsorted(table.nplc, nplc * (1 + 1e-9), side='right') - 1
+    valid &= nplc_index >= 0
+    nplc_index = np.maximum(nplc_index, 0)
+
+    native_digits = table.native_digits[nplc_index]
+    native_index, _ = _lookup(table.digits, native_digits)
+    result = (table.percent[range_index, nplc_index] * 1e-2 * magnitude
+              + table.counts[range_index, nplc_index] * table.count_size[range_index, native_index])
+
+    if resolution is not None:
+        digits = np.broadcast_to(np.asarray(resolution, dtype=np.float64), magnitude.shape)
+        digit_index, found = _lookup(table.digits, digits)
+        valid &= found
+        # Readings shown with fewer digits than the native ones are rounded to half a count
+        coarser = digits < native_digits
+        result = result + np.where(coarser, 0.5 * table.count_size[range_index, digit_index], 0.0)
+    return np.where(valid, result, np.nan)
@@ -0,0 +1,218 @@
+"""
+Module: VISA Session Manager
+Description: This module provides a process-wide pool of VISA sessions shared by the instrument
+             drivers. ResourceManager instances are created once per backend, resources are
+             opened once per address and handed out to every driver asking for them, their
+             identification strings are cached, and idle sessions are kept open for reuse
+             until the process exits.
+
+Author: Mykhailo Vorobiov
+Email: mvorobiov@wm.edu
+Date Created: 2024-10-15
+"""
+
+import atexit
+import logging
+import threading
+
+import pyvisa
+
+
+class VisaSessionManager:
+    """
+    Pool of VISA resources keyed by address.
+
+    It can be passed wherever the drivers expect a pyvisa.ResourceManager
+    (GPP25045, HP34401A, U1252B, ...): open_resource() returns the pooled session
+    of an address and counts its users, release() gives it back. Released sessions
+    stay open, so reconnecting to an instrument (e.g. through a remote VISA gateway)
+    is free; close_resource() or close_all() closes them for real.
+
+    Drivers sharing a session also share its settings (timeout, termination
+    characters) and must not talk to the instrument from different threads at once.
+    """
+
+    def __init__(self, backend='', log_level='INFO'):
+        """
+        :param backend: pyvisa backend specification, e.g. '' or '@py'.
+        :param log_level: Level of logging.
+        """
+        self.logger = logging.getLogger(__name__)
+        logging.basicConfig(level=log_level)
+        self.backend = backend
+        self._resource_manager = None
+        self._resources = {}
+        self._users = {}
+        self._addresses = {}  # id(resource) -> pool address; resource_name may be canonicalised
+        self._idn = {}
+        self._lock = threading.RLock()
+
+    @property
+    def resource_manager(self):
+        """
+        :return: The pyvisa.ResourceManager of the backend, created on first use.
+        """
+        with self._lock:
+            if self._resource_manager is None:
+                self._resource_manager = pyvisa.ResourceManager(self.backend)
+            return self._resource_manager
+
+    @staticmethod
+    def _is_open(resource):
+        try:
+            resource.session
+            return True
+        except pyvisa.errors.InvalidSession:
+            return False
+
+    def open_resource(self, resource_address, **kwargs):
+        """
+        Get the shared session of an address, opening it if needed.
+
+        :param resource_address: VISA resource address.
+        :param kwargs: Keyword arguments for pyvisa's open_resource(); only used when
+                       the session is actually opened.
+        :return: pyvisa resource.
+        """
+        with self._lock:
+            resource = self._resources.get(resource_address)
+            if resource is None or not self._is_open(resource):
+                resource = self.resource_manager.open_resource(resource_address, **kwargs)
+                if self._resources.get(resource_address) is not None:
+                    self._addresses.pop(id(self._resources[resource_address]), None)
+                self._resources[resource_address] = resource
+                self._addresses[id(resource)] = resource_address
+                self._users[resource_address] = 0
+                self._idn.pop(resource_address, None)
+                self.logger.debug(f'Opened VISA session {resource_address}.')
+            self._users[resource_address] += 1
+            return resource
+
+    def release(self, resource):
+        """
+        Give a session back to the pool. It stays open for later reuse.
+
+        :param resource: pyvisa resource returned by open_resource().
+        """
+        with self._lock:
+            address = self._addresses.get(id(resource))
+            if self._resources.get(address) is resource and self._users[address] > 0:
+                self._users[address] -= 1
+
+    def get_idn(self, resource_address, query):
+        """
+        Get the cached identification string of an instrument.
+
+        :param resource_address: VISA resource address.
+        :param query: Callable without arguments querying the identification, e.g. the
+                      driver's get_idn. Only called on a cache miss.
+        :return: Identification string, or None if the query failed.
+        """
+        with self._lock:
+            if resource_address in self._idn:
+                return self._idn[resource_address]
+        idn = query()
+        if idn is not None:
+            with self._lock:
+                self._idn[resource_address] = idn
+        return idn
+
+    def users(self, resource_address):
+        """
+        :return: Number of drivers currently holding the session of an address.
+        """
+        with self._lock:
+            return self._users.get(resource_address, 0)
+
+    def close_resource(self, resource_address):
+        """
+        Close the session of an address, e.g. after the instrument was power cycled.
+        The next open_resource() opens a fresh session.
+
+        :param resource_address: VISA resource address.
+        """
+        with self._lock:
+            resource = self._resources.pop(resource_address, None)
+            users = self._users.pop(resource_address, 0)
+            if resource is not None:
+                self._addresses.pop(id(resource), None)
+            self._idn.pop(resource_address, None)
+        if resource is None:
+            return
+        if users:
+            self.logger.warning(f'Closing VISA session {resource_address} still used by {users} driver(s).')
+        try:
+            resource.close()
+        except (pyvisa.VisaIOError, pyvisa.errors.InvalidSession) as e:
+            self.logger.error(f'Error closing VISA session {resource_address}: {e}')
+
+    def close_all(self):
+        """
+        Close all sessions and the resource manager.
+        """
+        with self._lock:
+            addresses = list(self._resources)
+        for address in addresses:
+            self.close_resource(address)
+        with self._lock:
+            if self._resource_manager is not None:
+                try:
+                    self._resource_manager.close()
+                except pyvisa.VisaIOError as e:
+                    self.logger.error(f'Error closing the VISA resource manager: {e}')
+                self._resource_manager = None
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_session_manager(backend=''):
+    """
+    Get the process-wide session manager of a VISA backend.
+
+    :param backend: pyvisa backend specification, e.g. '' or '@py'.
+    :return: VisaSessionManager instance, closed automatically at interpreter exit.
+    """
+    with _managers_lock:
+        manager = _managers.get(backend)
+        if manager is None:
+            manager = _managers[backend] = VisaSessionManager(backend)
+        return manager
+
+
+def get_idn(visa_rm, resource_address, query):
+    """
+    Query an identification string through the manager's cache when available.
+
+    :param visa_rm: VisaSessionManager or pyvisa.ResourceManager.
+    :param resource_address: VISA resource address.
+    :param query: Callable without arguments querying the identification.
+    :return: Identification string, or None if the query failed.
+    """
+    if isinstance(visa_rm, VisaSessionManager):
+        return visa_rm.get_idn(resource_address, query)
+    return query()
+
+
+def release_resource(visa_rm, resource):
+    """
+    Release a driver's session: back to the pool if it came from a VisaSessionManager,
+    otherwise close it.
+
+    :param visa_rm: VisaSessionManager or pyvisa.ResourceManager the resource came from.
+    :param resource: pyvisa resource.
+    """
+    if isinstance(visa_rm, VisaSessionManager):
+        visa_rm.release(resource)
+    else:
+        resource.close()
+
+
+@atexit.register
+def _close_managers():
+    with _managers_lock:
+        managers = list(_managers.values())
+        _managers.clear()
+    for manager in managers:
+        manager.close_all()
@@ -0,0 +1,432 @@
+"""
+Module: Waveform Containers
+Description: This module provides lightweight containers for oscilloscope waveforms
+             returned by the instrument drivers, such as an implicit (affine) time axis
+             that is only materialised on demand.
+
+Author: Mykhailo Vorobiov
+Email: mvorobiov@wm.edu
+Date Created: 2024-10-15
+"""
+
+import numpy as np
+
+# Relative distance from a sample position below which a time counts as that sample
+SNAP_TOLERANCE = 1e-9
+
+
+class TimeAxis:
+    """
+    An evenly sampled time axis t[i] = start + i * interval, i = 0..num_points-1.
+
+    The axis stores only its affine parameters. Time values are computed when the
+    axis is indexed or converted with np.asarray(), so it can be used wherever a
+    numpy array of times is expected (e.g. matplotlib) without keeping one in memory.
+    """
+
+    __slots__ = ('start', 'interval', 'num_points')
+
+    def __init__(self, start, interval, num_points):
+        """
+        :param start: Time of the first sample in seconds.
+        :param interval: Sampling interval in seconds.
+        :param num_points: Number of samples.
+        """
+        self.start = float(start)
+        self.interval = float(interval)
+        self.num_points = int(num_points)
+
+    def __repr__(self):
+        return (f'TimeAxis(start={self.start!r}, interval={self.interval!r}, '
+                f'num_points={self.num_points!r})')
+
+    def __len__(self):
+        return self.num_points
+
+    @property
+    def shape(self):
+        return (self.num_points,)
+
+    @property
+    def dtype(self):
+        return np.dtype(np.float64)
+
+    @property
+    def stop(self):
+        """Time of the last sample in seconds."""
+        return self.start + (self.num_points - 1) * self.interval
+
+    def __array__(self, dtype=None, copy=None):
+        values = self.start + np.arange(self.num_points) * self.interval
+        return values if dtype is None else values.astype(dtype, copy=False)
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        # Scalar arithmetic through numpy (np.float64(2) * t) stays affine like t * 2
+        if method == '__call__' and not kwargs and len(inputs) == 2 and ufunc in _AFFINE_UFUNCS:
+            forward, reflected = _AFFINE_UFUNCS[ufunc]
+            if inputs[0] is self and np.isscalar(inputs[1]):
+                return getattr(self, forward)(inputs[1])
+            if inputs[1] is self and np.isscalar(inputs[0]) and reflected:
+                return getattr(self, reflected)(inputs[0])
+        if method == '__call__' and not kwargs and ufunc is np.negative:
+            return -self
+        # Any other numpy operation works on the materialised time values
+        inputs = [np.asarray(x) if isinstance(x, TimeAxis) else x for x in inputs]
+        if 'out' in kwargs:
+            kwargs['out'] = tuple(np.asarray(x) if isinstance(x, TimeAxis) else x for x in kwargs['out'])
+        return getattr(ufunc, method)(*inputs, **kwargs)
+
+    def __getattr__(self, name):
+        # ndarray methods (mean, reshape, ...) act on the materialised time values
+        if name in TimeAxis.__slots__ or name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(np.asarray(self), name)
+
+    # Scaling and shifting by a scalar stays affine (e.g. t * 1e6 for microseconds);
+    # arrays fall back to the materialised time values.
+    def __mul__(self, other):
+        if np.isscalar(other):
+            return TimeAxis(self.start * other, self.interval * other, self.num_points)
+        return np.asarray(self) * other
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, other):
+        if np.isscalar(other):
+            return TimeAxis(self.start / other, self.interval / other, self.num_points)
+        return np.asarray(self) / other
+
+    def __add__(self, other):
+        if np.isscalar(other):
+            return TimeAxis(self.start + other, self.interval, self.num_points)
+        return np.asarray(self) + other
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        if np.isscalar(other):
+            return TimeAxis(self.start - other, self.interval, self.num_points)
+        return np.asarray(self) - other
+
+    def __rsub__(self, other):
+        if np.isscalar(other):
+            return TimeAxis(other - self.start, -self.interval, self.num_points)
+        return other - np.asarray(self)
+
+    def __neg__(self):
+        return TimeAxis(-self.start, -self.interval, self.num_points)
+
+    # Comparisons give boolean masks, e.g. v[t > 0]
+    def __lt__(self, other):
+        return np.asarray(self) < other
+
+    def __le__(self, other):
+        return np.asarray(self) <= other
+
+    def __gt__(self, other):
+        return np.asarray(self) > other
+
+    def __ge__(self, other):
+        return np.asarray(self) >= other
+
+    def __eq__(self, other):
+        return np.asarray(self) == other
+
+    def __ne__(self, other):
+        return np.asarray(self) != other
+
+    __hash__ = None
+
+    def min(self):
+        """Smallest time value."""
+        return min(self.start, self.stop)
+
+    def max(self):
+        """Largest time value."""
+        return max(self.start, self.stop)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            first, last, step = key.indices(self.num_points)
+            num_points = len(range(first, last, step))
+            return TimeAxis(self.start + first * self.interval, self.interval * step, num_points)
+        if isinstance(key, (int, np.integer)):
+            if not -self.num_points <= key < self.num_points:
+                raise IndexError(f'Index {key} is out of range for {self.num_points} points.')
+            return self.start + (key % self.num_points) * self.interval
+        index = np.arange(self.num_points)[key]
+        return self.start + index * self.interval
+
+    def index_of(self, times, side='left'):
+        """
+        Find indices where the given times would be inserted to keep the axis ordered.
+
+        Equivalent to np.searchsorted(np.asarray(axis), times, side) for a positive
+        interval, computed in constant time per value. Times within rounding error of
+        a sample time count as that sample time.
+
+        :param times: Scalar or array of times in seconds.
+        :param side: 'left' or 'right', as in np.searchsorted.
+        :return: Integer index or array of indices in the range [0, num_points].
+        """
+        position = (np.asarray(times, dtype=np.float64) - self.start) / self.interval
+        nearest = np.round(position)
+        snap = np.abs(position - nearest) <= SNAP_TOLERANCE * np.maximum(np.abs(nearest), 1)
+        position = np.where(snap, nearest, position)
+        if side == 'left':
+            index = np.ceil(position)
+        elif side == 'right':
+            index = np.floor(position) + 1
+        else:
+            raise ValueError(f"Invalid side '{side}'. Valid values: 'left', 'right'.")
+        index = np.clip(index, 0, self.num_points).astype(np.intp)
+        return index if index.ndim else int(index)
+
+    def slice_between(self, t_start, t_stop):
+        """
+        Build the index slice of samples with t_start <= t < t_stop.
+
+        :param t_start: Start time in seconds.
+        :param t_stop: Stop time in seconds.
+        :return: Slice object usable on the axis and on the matching sample arrays.
+        """
+        return slice(self.index_of(t_start, 'left'), self.index_of(t_stop, 'left'))
+
+
+# ufunc -> (operator, reflected operator) of TimeAxis keeping scalar arithmetic affine
+_AFFINE_UFUNCS = {np.multiply: ('__mul__', '__rmul__'),
+                  np.add: ('__add__', '__radd__'),
+                  np.subtract: ('__sub__', '__rsub__'),
+                  np.true_divide: ('__truediv__', None)}
+
+
+class RawWaveform:
+    """
+    Raw ADC codes of a waveform together with the affine scaling to volts.
+
+    volts = codes * gain - offset
+
+    Keeping the integer codes allows averaging, thresholding and similar processing
+    in code space; only the final result needs to be converted to volts.
+    """
+
+    __slots__ = ('codes', 'gain', 'offset')
+
+    def __init__(self, codes, gain, offset):
+        """
+        :param codes: Integer array of raw ADC codes.
+        :param gain: Volts per code.
+        :param offset: Offset in volts subtracted after scaling.
+        """
+        self.codes = codes
+        self.gain = float(gain)
+        self.offset = float(offset)
+
+    def __repr__(self):
+        return (f'RawWaveform(codes=<{self.codes.size} x {self.codes.dtype}>, '
+                f'gain={self.gain!r}, offset={self.offset!r})')
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, key):
+        return RawWaveform(self.codes[key], self.gain, self.offset)
+
+    def __array__(self, dtype=None, copy=None):
+        return self.to_volts() if dtype is None else self.to_volts().astype(dtype, copy=False)
+
+    def scale(self, codes, out=None, dtype=np.float32):
+        """
+        Convert codes (or code-space results such as averages) to volts.
+
+        :param codes: Array of codes scaled with this waveform's gain and offset.
+        :param out: Optional floating point array to write the result into.
+        :param dtype: Result dtype if out is not given.
+        :return: Array of voltages (out if given).
+        """
+        if out is None:
+            out = np.empty(np.shape(codes), dtype=dtype)
+        out[...] = codes
+        out *= self.gain
+        out -= self.offset
+        return out
+
+    def to_volts(self, key=slice(None), out=None, dtype=np.float32):
+        """
+        Convert the codes, or a slice of them, to volts.
+
+        :param key: Index or slice of the samples to convert. Default all samples.
+        :param out: Optional floating point array to write the result into (may be in place
+                    of a previously converted buffer).
+        :param dtype: Result dtype if out is not given.
+        :return: Array of voltages.
+        """
+        return self.scale(self.codes[key], out=out, dtype=dtype)
+
+    def volts_to_codes(self, volts):
+        """
+        Convert voltages, e.g. trigger thresholds, to (fractional) codes.
+
+        :param volts: Scalar or array of voltages.
+        :return: Codes corresponding to the voltages.
+        """
+        return (np.asarray(volts) + self.offset) / self.gain
+
+
+class Envelope:
+    """
+    Fixed-size min/max/mean envelope of a waveform, kept in code space with its scaling.
+    """
+
+    __slots__ = ('time', 'minimum', 'maximum', 'mean', 'gain', 'offset')
+
+    def __init__(self, time, minimum, maximum, mean, gain=1.0, offset=0.0):
+        """
+        :param time: TimeAxis of the bin centres.
+        :param minimum: Array of per-bin minimum codes.
+        :param maximum: Array of per-bin maximum codes.
+        :param mean: Array of per-bin mean codes.
+        :param gain: Volts per code.
+        :param offset: Offset in volts subtracted after scaling.
+        """
+        self.time = time
+        self.minimum = minimum
+        self.maximum = maximum
+        self.mean = mean
+        self.gain = gain
+        self.offset = offset
+
+    def __len__(self):
+        return len(self.minimum)
+
+    def to_volts(self):
+        """
+        Convert the envelope to volts.
+
+        :return: Tuple of minimum, maximum and mean voltage arrays.
+        """
+        scaling = RawWaveform(None, self.gain, self.offset)
+        return (scaling.scale(self.minimum), scaling.scale(self.maximum), scaling.scale(self.mean))
+
+
+class StreamingDecimator:
+    """
+    Computes a min/max/mean envelope of a record in one pass, chunk by chunk.
+
+    The record of num_points samples is divided into bins of equal length (the
+    last bin may be shorter). Chunks are fed in order with update(), e.g. as they
+    arrive from a chunked transfer, and each chunk is reduced with one vectorized
+    call per statistic.
+    """
+
+    def __init__(self, num_points, n_bins=2000):
+        """
+        :param num_points: Total number of samples of the record.
+        :param n_bins: Maximum number of envelope bins.
+        """
+        self.num_points = int(num_points)
+        self.bin_points = max(-(-self.num_points // n_bins), 1)
+        self.n_bins = -(-self.num_points // self.bin_points)
+        self.minimum = None
+        self.maximum = None
+        self.sums = np.zeros(self.n_bins, dtype=np.float64)
+        self.position = 0
+
+    def update(self, chunk):
+        """
+        Reduce the next chunk of samples into the envelope.
+
+        :param chunk: Array of the samples following the previously fed ones.
+        """
+        if chunk.size == 0:
+            return
+        if self.minimum is None:
+            info = np.iinfo(chunk.dtype) if chunk.dtype.kind in 'iu' else np.finfo(chunk.dtype)
+            self.minimum = np.full(self.n_bins, info.max, dtype=chunk.dtype)
+            self.maximum = np.full(self.n_bins, info.min, dtype=chunk.dtype)
+        start = self.position
+        stop = start + chunk.size
+        if stop > self.num_points:
+            raise ValueError(f'More than {self.num_points} samples fed to the decimator.')
+        first_bin = start // self.bin_points
+        last_bin = (stop - 1) // self.bin_points
+        edges = np.arange(first_bin + 1, last_bin + 1) * self.bin_points - start
+        edges = np.concatenate(([0], edges))
+        bins = slice(first_bin, last_bin + 1)
+        np.minimum(self.minimum[bins], np.minimum.reduceat(chunk, edges), out=self.minimum[bins])
+        np.maximum(self.maximum[bins], np.maximum.reduceat(chunk, edges), out=self.maximum[bins])
+        self.sums[bins] += np.add.reduceat(chunk, edges, dtype=np.float64)
+        self.position = stop
+
+    def envelope(self, time_data=None, gain=1.0, offset=0.0):
+        """
+        Finish the envelope.
+
+        :param time_data: TimeAxis of the full record. Defaults to sample indices.
+        :param gain: Volts per code of the record.
+        :param offset: Offset in volts of the record.
+        :return: Envelope instance.
+        """
+        counts = np.full(self.n_bins, self.bin_points, dtype=np.float64)
+        counts[-1] = self.num_points - (self.n_bins - 1) * self.bin_points
+        if time_data is None:
+            time_data = TimeAxis(0, 1, self.num_points)
+        bin_time = TimeAxis(time_data.start + 0.5 * (self.bin_points - 1) * time_data.interval,
+                            self.bin_points * time_data.interval,
+                            self.n_bins)
+        return Envelope(bin_time, self.minimum, self.maximum, self.sums / counts, gain, offset)
+
+
+def decimate(time_data, raw_waveform, n_bins=2000, chunk_points=1 << 20):
+    """
+    Compute the min/max/mean envelope of a raw waveform without converting it to volts.
+
+    :param time_data: TimeAxis of the waveform.
+    :param raw_waveform: RawWaveform (or plain array of samples).
+    :param n_bins: Maximum number of envelope bins.
+    :param chunk_points: Number of samples reduced per vectorized step.
+    :return: Envelope instance.
+    """
+    codes = raw_waveform.codes if isinstance(raw_waveform, RawWaveform) else np.asarray(raw_waveform)
+    decimator = StreamingDecimator(codes.size, n_bins)
+    for start in range(0, codes.size, chunk_points):
+        decimator.update(codes[start:start + chunk_points])
+    if isinstance(raw_waveform, RawWaveform):
+        return decimator.envelope(time_data, raw_waveform.gain, raw_waveform.offset)
+    return decimator.envelope(time_data)
+
+
+def lttb(values, n_out):
+    """
+    Select points with the Largest-Triangle-Three-Buckets algorithm.
+
+    Works on evenly sampled data (codes or volts); the returned indices select the
+    points from both the samples and the matching TimeAxis.
+
+    :param values: 1-D array of samples.
+    :param n_out: Number of points to keep.
+    :return: Sorted array of selected sample indices.
+    """
+    values = np.asarray(values)
+    num_points = values.size
+    if n_out >= num_points or n_out < 3:
+        return np.arange(num_points)
+    edges = np.linspace(1, num_points - 1, n_out - 1).astype(np.intp)
+    selected = np.empty(n_out, dtype=np.intp)
+    selected[0] = 0
+    selected[-1] = num_points - 1
+    previous = 0
+    for bucket in range(n_out - 2):
+        start, stop = edges[bucket], edges[bucket + 1]
+        next_stop = edges[bucket + 2] if bucket + 2 < len(edges) else num_points
+        next_x = 0.5 * (stop + next_stop - 1)
+        next_y = values[stop:next_stop].mean(dtype=np.float64)
+        x = np.arange(start, stop)
+        # Differences in float64, integer codes would wrap around
+        y = values[start:stop].astype(np.float64)
+        previous_y = float(values[previous])
+        area = np.abs((previous - next_x) * (y - previous_y)
+                      - (previous - x) * (next_y - previous_y))
+        previous = start + int(np.argmax(area))
+        selected[bucket + 1] = previous
+    return selected